@@ -1,129 +1,191 @@
+import functools
 import random
+from collections import namedtuple
 import numpy as np
 
 # 1. Deck
 # ----------------------------------------------------------------------------
 
+def shuffled_decks(rng, num_decks):
+    # num_decks decks as rows of 24 of the cards 3..35 in random order, from a
+    # numpy.random.Generator
+    cards = np.broadcast_to(np.arange(3, 36), (num_decks, 33))
+    return rng.permuted(cards, axis=1)[:, :24]
+
+
+class DeckSource(object):
+    """
+    Hands out shuffled decks, generated batch at a time from a seeded
+    numpy.random.Generator so dealing a game costs a list lookup.
+    """
+
+    def __init__(self, seed=None, batch=4096):
+        self.rng = np.random.default_rng(seed)
+        self.batch = batch
+        self.decks = []
+        self.index = 0
+        # Generator state the current batch was dealt from
+        self.batch_state = self.rng.bit_generator.state
+
+    def next(self):
+        if self.index == len(self.decks):
+            self.batch_state = self.rng.bit_generator.state
+            self.decks = shuffled_decks(self.rng, self.batch).tolist()
+            self.index = 0
+        self.index += 1
+        return self.decks[self.index - 1]
+
+    def get_state(self):
+        # JSON-able; the current batch is dealt again on set_state rather
+        # than stored
+        return {'rng': self.batch_state, 'batch': self.batch, 'index': self.index, 'dealt': len(self.decks) > 0}
+
+    def set_state(self, state):
+        self.rng.bit_generator.state = self.batch_state = state['rng']
+        self.batch = state['batch']
+        self.decks = shuffled_decks(self.rng, self.batch).tolist() if state['dealt'] else []
+        self.index = state['index']
+
+
+def seed_stream(seed, *key):
+    """
+    Child stream key of the root seed (an int, None or a SeedSequence) as
+    a SeedSequence. A stream only depends on the root seed and its key, so
+    env k of a run is seeded the same whatever the number of workers or
+    envs next to it.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + key, pool_size=seed.pool_size)
+
+
+# seed_stream keys of a run seed reserved for the batched training envs,
+# the evaluation during training, test-time evaluation (inference.evaluate)
+# and dataset generation (trajectory.generate). The serial env and collector
+# worker pid use key pid, well below these; the collector workers of a run
+# resumed after iteration i use the keys of stream (RESUME_STREAM, i).
+VEC_ENV_STREAM = 10000
+EVAL_STREAM = 10001
+TEST_STREAM = 10002
+DATASET_STREAM = 10003
+RESUME_STREAM = 10004
+
+
+def seeded_rngs(seed):
+    # The random.Random for players' choices and the DeckSource of a seed,
+    # on two independent streams of it
+    play_seed = int(seed_stream(seed, 0).generate_state(1, np.uint64)[0])
+    return random.Random(play_seed), DeckSource(seed_stream(seed, 1))
+
+
 class Deck(object):
     """
     Deck consists of list of numbers (cards). Is initialised with standard list
     of cards in No Thanks!. Decks can be shuffled, drawn from and number of 
-    cards counted.
+    cards counted. Cards are drawn by moving index along the list.
     """
     
     def __init__(self):
         self.deck = []
+        self.index = 0
         
-    def build(self):
-        cards_all = range(3,36)
-        deck = random.sample(cards_all, 24)
-        
-        for card in deck:
-            self.deck.append(card)
+    def build(self, rng=random, source=None):
+        # Take the next deck of source (a DeckSource) if given, otherwise
+        # shuffle one with rng
+        if source is not None:
+            self.deck = source.next()
+        else:
+            self.deck = rng.sample(range(3,36), 24)
+        self.index = 0
         
         # print("The deck has been shuffled.")
             
     def draw(self):
-        return self.deck.pop()
+        self.index += 1
+        return self.deck[self.index - 1]
 
     def check_end(self):
-        if self.deck == []:
-            return True
+        return self.index == len(self.deck)
         
 # 2. Player
 # ----------------------------------------------------------------------------
+
+# Starting chips by number of players
+START_CHIPS = {3: 11, 4: 11, 5: 11, 6: 9, 7: 7}
+
+
+def start_chips(num_players):
+    if num_players not in START_CHIPS:
+        raise ValueError(f"No Thanks! is played by 3 to 7 players, not {num_players}")
+    return START_CHIPS[num_players]
+
         
 class Player(object):
     """
     Player consists of a list of cards and number of chips in posession.
     Players can take or pass cards and/or chips. Total points to player at any
-    time can be calculated.
+    time can be calculated. The hand is also kept as a bitmask (bit c set when
+    card c is held) with its card points updated on every take, so scoring a
+    hand or a candidate card is constant time.
     """
     
-    def __init__(self, name):
+    def __init__(self, name, chip_hand=11):
         # Initialise the number of cards and chips
         self.name = name
         self.card_hand = list()
-        self.chip_hand = 11
-        
-    def draw_card(self, deck, player):
-        # Take a card from the deck
-        global card_pool
+        self.hand_bits = 0
+        self.card_points = 0
+        self.chip_hand = chip_hand
         
-        card_pool = deck.draw()
-        # print(f'{self.name} draws the number ' + str(card_pool) + ".")
-        
-        player.weighted_play(player, deck)
-    
-    def take_card(self, player, deck):
+    def take_card(self, game):
         # Player takes the card
         # Card +1
         # Chips +1
-        # If game continues
-        global card_pool
-        global chip_pool
-        
-        self.card_hand.append(card_pool)
-        self.chip_hand += chip_pool
+        self.add_card(game.card_pool)
+        self.chip_hand += game.chip_pool
         
-        # print(f'{self.name} takes the ' + str(card_pool) + " and " + str(chip_pool) + " chips.")
+        # print(f'{self.name} takes the ' + str(game.card_pool) + " and " + str(game.chip_pool) + " chips.")
         # print(f'{self.name} has ' + str(self.chip_hand) + ' chips remaining.')
         
-        chip_pool = 0
+        game.chip_pool = 0
         
-        if deck.check_end() != True:
-            player.draw_card(deck, player)
-        
-    def pass_card(self):
+    def pass_card(self, game):
         # Pass the card
         # Increase the number of chips on the card
-        global card_pool
-        global chip_pool
-        
         self.chip_hand -= 1
-        chip_pool += 1
+        game.chip_pool += 1
         
-        # print(f'{self.name} passes the ' + str(card_pool) + " and loses a chip.")
+        # print(f'{self.name} passes the ' + str(game.card_pool) + " and loses a chip.")
         # print(f'{self.name} has ' + str(self.chip_hand) + ' chips remaining.')
         
-    def rand_play(self, player, deck):
+    def rand_play(self, game):
         # random player：randomly decides to keep the card or not
         """
-        Action is randomly determined. Note that players must take a card if
-        they are out of chips.
+        Action is randomly determined. Returns True to take the card; Game
+        makes players that are out of chips take it anyway.
         """
-        global chip_pool
-        decision = random.randint(0,1)
-        
-        
-        if self.chip_hand == 0:
-            decision == 0
-        
-        if decision == 0:
-            player.take_card(player, deck)
-            
-        if decision == 1:
-            player.pass_card()
+        return game.rng.randint(0,1) == 0
             
-    def remove_runs(player_hand):
-        # Removes consecutive cards, only count the card with the smallest point in the consecutive row
-        player_hand.sort()
-        player_hand.reverse()
-        remove_list = []
-        
-        for i in player_hand:
-            if i-1 in player_hand:
-                remove_list.append(i)
-
-        for i in remove_list:
-            player_hand.remove(i)
-            
-        return player_hand
+    def add_card(self, card):
+        # Add a card to the hand, updating the card points incrementally
+        self.card_points = self.score_if_taken(card)
+        self.hand_bits |= 1 << card
+        self.card_hand.append(card)
+    
+    def score_if_taken(self, card):
+        # Card points of the hand after taking card, only the smallest card
+        # of a consecutive row counts. Just card-1 and card+1 matter: card
+        # opens a new row, extends one upwards, becomes the new smallest card
+        # of one, or joins two rows together.
+        below = (self.hand_bits << 1) >> card & 1
+        above = self.hand_bits >> (card + 1) & 1
+        if below:
+            return self.card_points - (card + 1) * above
+        return self.card_points + card - (card + 1) * above
     
     def point_tally(self):
         # Counting the points
-        self.card_hand = Player.remove_runs(self.card_hand)
-        card_points = sum(self.card_hand)
+        card_points = self.card_points
         chip_points = self.chip_hand
         return card_points - chip_points
     
@@ -137,188 +199,557 @@ class Player(object):
             return 0
 
     
-    def weighted_play(self, player, deck):
-        # Use weights to decide if to keep the card
-        global card_pool
-        global chip_pool
-        
+    def weighted_play(self, game, chip_weight=None):
+        # Use weights to decide if to keep the card, True means take
+        # chip_weight defaults to Player.chip_weight
+        chip_weight = chip_weight or Player.chip_weight
         # If there is no chips left, player can only take the card.
         if self.chip_hand == 0:
-            player.take_card(player, deck)
+            return True
         
-        take_card_hand = Player.remove_runs(self.card_hand + [card_pool])
-        take_chip_hand = self.chip_hand + chip_pool
-        pass_card_hand = Player.remove_runs(self.card_hand)
+        take_chip_hand = self.chip_hand + game.chip_pool
         pass_chip_hand = self.chip_hand - 1
         
-        take_value = sum(take_card_hand) - Player.chip_weight(take_chip_hand) * take_chip_hand
-        pass_value = sum(pass_card_hand) - Player.chip_weight(pass_chip_hand) * pass_chip_hand
+        take_value = self.score_if_taken(game.card_pool) - chip_weight(take_chip_hand) * take_chip_hand
+        pass_value = self.card_points - chip_weight(pass_chip_hand) * pass_chip_hand
         
         # print('take_value is '+str(take_value)+' and pass_value is '+str(pass_value))
         
-        if take_value <= pass_value:
-            player.take_card(player, deck)
-            
-        else:
-            player.pass_card()
+        return take_value <= pass_value
 
-    def combine_play(self, player, deck, prob = 0.5):
-        if np.random.rand() < prob:
-            return self.weighted_play(player, deck)
+    def combine_play(self, game, prob = 0.5):
+        if game.rng.random() < prob:
+            return self.weighted_play(game)
         else:
-            return self.rand_play(player, deck)
+            return self.rand_play(game)
         
         
         
     
 # 3. Game
 # ----------------------------------------------------------------------------
-class NTEnv():
-    def __init__(self, num_players = 3, debug = False) -> None:
-        # The first player is controlled by human player
-        self.players = []
-        for i in range(num_players):
-            self.players.append(Player("player" + str(i)))
-            # print(self.players[i].name)
-        
+
+# Everything that changes while a game is played, as saved by Game.clone.
+# Per player tuples are in seat order; deck is shared with the game, it is
+# never modified once dealt.
+GameState = namedtuple('GameState', ['card_hands', 'hand_bits', 'card_points', 'chip_hands',
+                                     'deck', 'deck_index', 'card_pool', 'chip_pool',
+                                     'current_player', 'done'])
+
+
+class Game(object):
+    """
+    Game holds everything that belongs to one game of No Thanks!: the players,
+    the deck, the card currently on offer (card_pool), the chips placed on it
+    (chip_pool), whose decision it is (current_player) and how many cards
+    have been turned over (deck_index). It is an explicit state machine: each
+    call to step plays exactly one take/pass decision, so drivers loop over
+    step instead of players calling each other. Each player is dealt the
+    starting chips for the number of players. A recorder (see
+    trajectory.TrajectoryWriter) is told about the deal, every decision and
+    the end of the game. clone saves the state of a game and restore puts
+    it back, so a position can be searched from and returned to without
+    copying Player or Deck objects.
+    """
+    
+    def __init__(self, players, rng=random, first_player=None, decks=None, recorder=None):
+        self.players = players
+        for player in players:
+            player.chip_hand = start_chips(len(players))
+        self.rng = rng
         self.deck = Deck()
-        self.deck.build()
-        turn_on = np.random.randint(len(self.players))
-        global card_pool
-        global chip_pool
-        card_pool = 0
-        chip_pool = 0
+        self.deck.build(rng, decks)
+        self.chip_pool = 0
+        self.done = False
+        if first_player is None:
+            first_player = rng.randrange(len(players))
+        self.current_player = first_player
+        # The first player turns over the top card
+        self.card_pool = self.deck.draw()
+        self.deck_index = 1
+        self.recorder = recorder
+        if recorder is not None:
+            recorder.start_game(self)
+
+    def step(self, take):
+        # Play one decision for current_player. A player out of chips must
+        # take. Whoever takes turns over the next card and decides again,
+        # passing moves the turn on.
+        player = self.players[self.current_player]
+        take = take or player.chip_hand == 0
+        if self.recorder is not None:
+            self.recorder.record(self, take)
+        if take:
+            player.take_card(self)
+            if self.deck.check_end() == True:
+                self.done = True
+                if self.recorder is not None:
+                    self.recorder.end_game(self)
+            else:
+                self.card_pool = self.deck.draw()
+                self.deck_index += 1
+        else:
+            player.pass_card(self)
+            self.current_player = (self.current_player + 1) % len(self.players)
+
+    def play_until(self, seat, play):
+        # Let play(player, game) decide for everyone else until it is seat's
+        # turn or the game is over
+        while not self.done and self.current_player != seat:
+            player = self.players[self.current_player]
+            self.step(play(player, self))
+
+    def points(self):
+        return [player.point_tally() for player in self.players]
+
+    def clone(self):
+        # The GameState of this game, a handful of ints per player
+        players = self.players
+        return GameState(tuple(tuple(player.card_hand) for player in players),
+                         tuple(player.hand_bits for player in players),
+                         tuple(player.card_points for player in players),
+                         tuple(player.chip_hand for player in players),
+                         self.deck.deck, self.deck_index, self.card_pool, self.chip_pool,
+                         self.current_player, self.done)
+
+    def restore(self, state):
+        # Put back a GameState cloned from this game. The recorder is not
+        # told, decisions played between clone and restore stay recorded.
+        for i, player in enumerate(self.players):
+            player.card_hand[:] = state.card_hands[i]
+            player.hand_bits = state.hand_bits[i]
+            player.card_points = state.card_points[i]
+            player.chip_hand = state.chip_hands[i]
+        self.deck.deck = state.deck
+        self.deck.index = self.deck_index = state.deck_index
+        self.card_pool = state.card_pool
+        self.chip_pool = state.chip_pool
+        self.current_player = state.current_player
+        self.done = state.done
+
+
+OBS_SIZE = 75
+PACKED_OBS_SIZE = 12
+
+
+def unpack_obs(packed):
+    # Expand 'packed' observations (..., 12) to the float32 get_obs layout (..., 75)
+    bits = np.unpackbits(packed[..., :9], axis=-1)
+    obs = np.empty(packed.shape[:-1] + (OBS_SIZE,), dtype=np.float32)
+    obs[..., :36] = bits[..., :36]
+    obs[..., 36] = packed[..., 9]
+    obs[..., 37:73] = bits[..., 36:]
+    obs[..., 73] = packed[..., 10]
+    obs[..., 74] = packed[..., 11]
+    return obs
+
+
+def pack_obs(obs):
+    # The inverse of unpack_obs, float observations (..., 75) to 'packed' (..., 12)
+    packed = np.empty(obs.shape[:-1] + (PACKED_OBS_SIZE,), dtype=np.uint8)
+    cards = np.concatenate([obs[..., :36], obs[..., 37:73]], axis=-1).astype(np.uint8)
+    packed[..., :9] = np.packbits(cards, axis=-1)
+    packed[..., 9] = obs[..., 36]
+    packed[..., 10] = obs[..., 73]
+    packed[..., 11] = obs[..., 74]
+    return packed
+
+
+def float_obs(obs):
+    # Observations of any obs_mode in the float32 layout the networks take
+    obs = np.asarray(obs)
+    return unpack_obs(obs) if obs.dtype == np.uint8 else obs.astype(np.float32, copy=False)
+
+
+def should_take(info):
+    # Take without asking the agent when the card joins one of its rows or
+    # costs no more points than the chips on it (info as returned by step)
+    return info['card_pool'] in info['valued_cards'] or \
+        info['card_pool'] <= info['chip_pool']
+
+
+class NTEnv():
+    """
+    obs_mode picks the observation format: 'float64' (default) and 'float32'
+    give the 75 entry layout [own cards (36), own chips, opponents' cards
+    (36), card_pool, chip_pool]; 'packed' gives 12 uint8s, the two card sets
+    as 72 bits (np.packbits order) followed by own chips, card_pool and
+    chip_pool (see unpack_obs). The observation lives in one preallocated
+    buffer that is updated with the cards taken since the last step rather
+    than rebuilt. get_obs returns a copy unless copy_obs is False, in which
+    case it returns the buffer itself, overwritten by the next reset/step.
+    recorder is handed to every Game the env deals.
+    """
+    def __init__(self, num_players = 3, debug = False, seed = None, prob = 0.5,
+                 obs_mode = 'float64', copy_obs = True, recorder = None, opponent_play = None) -> None:
+        # The first player is controlled by human player, the others play
+        # opponent_play(player, game), by default Player.combine_play with
+        # probability prob of weighted_play
+        self.num_players = num_players
+        self.opponent_play = opponent_play or functools.partial(Player.combine_play, prob=prob)
+        self.rng, self.decks = seeded_rngs(seed)
         self.debug = debug
+        self.packed = obs_mode == 'packed'
+        if self.packed:
+            self.obs = np.zeros(PACKED_OBS_SIZE, dtype=np.uint8)
+        else:
+            self.obs = np.zeros(OBS_SIZE, dtype=obs_mode)
+        self.copy_obs = copy_obs
+        self.recorder = recorder
+        self.reset()
 
     def reset(self):
-        self.deck = Deck()
-        self.deck.build()
-        self.turn_on = np.random.randint(len(self.players))
-        global card_pool
-        global chip_pool
-        card_pool = 0
-        chip_pool = 0
-        return self.get_obs()
+        # Deal until the agent (seat 0) has a decision to make
+        while True:
+            self.players = []
+            for i in range(self.num_players):
+                self.players.append(Player("player" + str(i)))
+                # print(self.players[i].name)
+            
+            self.game = Game(self.players, self.rng, decks=self.decks, recorder=self.recorder)
+            self.game.play_until(0, self.opponent_play)
+            if not self.game.done:
+                self.obs[:] = 0
+                self.cards_written = [0] * self.num_players
+                self.update_obs()
+                return self.get_obs()
     
+    def update_obs(self):
+        # Mark the cards taken since the last update, then the chip counts
+        for i, player in enumerate(self.players):
+            for card in player.card_hand[self.cards_written[i]:]:
+                if self.packed:
+                    bit = card if i == 0 else 36 + card
+                    self.obs[bit >> 3] |= 0x80 >> (bit & 7)
+                else:
+                    self.obs[card if i == 0 else 37 + card] = 1
+            self.cards_written[i] = len(player.card_hand)
+
+        if self.packed:
+            self.obs[9:] = self.players[0].chip_hand, self.game.card_pool, self.game.chip_pool
+        else:
+            self.obs[36] = self.players[0].chip_hand
+            self.obs[73], self.obs[74] = self.game.card_pool, self.game.chip_pool
+
     def get_obs(self):
-        # 
-        state1 = np.zeros(36)
-        state1[self.players[0].card_hand] = 1
-        state2 = np.array(self.players[0].chip_hand).reshape(-1)
-
-        state3 = np.zeros(36)
-        for i in self.players[1:]:
-            state3[i.card_hand] = 1
-
-        global card_pool
-        global chip_pool
-        state4 = np.zeros(2)
-        state4[0], state4[1] = card_pool, chip_pool
-        # print(state1, state2, state3, state4)
-        return np.concatenate([state1, state2, state3, state4])
+        if self.copy_obs:
+            return self.obs.copy()
+        return self.obs
     
     def step(self, action):
-        # actio： int
+        # actio： int, 0 takes the card and 1 passes
+        # The agent decides, then the opponents play until the agent is to
+        # decide again or the last card has been taken.
         reward = 0
-        done = False
-        if self.turn_on != 0:
-            for i in range(self.turn_on, len(self.players)):
-                self.players[i].combine_play(self.players[i], self.deck)
-                # self.players[i].weighted_play(self.players[i], self.deck)
-                self.turn_on += 1
-                self.turn_on = self.turn_on % len(self.players)
+        self.game.step(action == 0)
+        self.game.play_until(0, self.opponent_play)
+        self.update_obs()
+        done = self.game.done
+        if done:
+            points = self.game.points()
+            # print(points)
+            if points[0] == min(points):
+                # Win
+                reward = 100
+            else:
+                reward = -100
+
         info = {}
         cards = self.players[0].card_hand
         should_takes = [i - 1 for i in cards] + [i + 1 for i in cards]
         should_takes = list(set(should_takes))
         info['valued_cards'] = should_takes
-        global card_pool
-        global chip_pool
-        info['card_pool'] = card_pool
-        info['chip_pool'] = chip_pool
-        if action == 0:
-            self.players[0].take_card(self.players[0], self.deck)
-            if self.deck.check_end() == True:
-                done  = True
-                points = [i.point_tally()  for i in self.players]
-                # print(points)
-                if points[0] == min(points):
-                    # Win
-                    reward = 100
-                else:
-                    reward = -100
-        else:
-            self.players[0].pass_card()
-        
-        self.turn_on += 1
-        self.turn_on = self.turn_on % len(self.players)
+        info['card_pool'] = self.game.card_pool
+        info['chip_pool'] = self.game.chip_pool
         return self.get_obs(), reward, done, info
 
     
     def close(self):
         self.reset()
-    def seed(self):
-        self.reset()
+    def seed(self, seed=None):
+        self.rng, self.decks = seeded_rngs(seed)
+        return self.reset()
+    def get_rng_state(self):
+        # JSON-able state of the play and deck generators, for checkpoints
+        version, internal, gauss = self.rng.getstate()
+        return {'play': [version, list(internal), gauss], 'decks': self.decks.get_state()}
+    def set_rng_state(self, state):
+        version, internal, gauss = state['play']
+        self.rng.setstate((version, tuple(internal), gauss))
+        self.decks.set_state(state['decks'])
     def render(self):
         pass
         
 
 
-def Run_Game(player_1, player_2, player_3):
+def Run_Game(*player_names, plays=None):
     """
     A game reflects an iteration of turns, until the deck emtpies and total
-    points are tallied. Winner is then determined. Initialised with three
-    players.
+    points are tallied. Winner is then determined. Initialised with one
+    player per name, 3 to 7 of them. plays holds a play(player, game) per
+    player (see tournament.get_strategy), Player.weighted_play by default.
     """
 
-    Player_1 = Player(player_1)
-    Player_2 = Player(player_2)
-    Player_3 = Player(player_3)
+    players = [Player(name) for name in player_names]
+    plays = plays or [Player.weighted_play] * len(players)
 
-    deck = Deck()
-    deck.build()
-    turn_no = 1
-    global card_pool
-    global chip_pool 
-    """
-    Global used as card_pool and chip_pool need to be updated each turn so
-    cannot be reset between function calls.
-    """
-    card_pool = 0
-    chip_pool = 0
+    game = Game(players, first_player=0)
     
-    Player_1.draw_card(deck, Player_1)
-    
-    while deck.check_end() != True:
-        turn_no += 1
-        
-        if turn_no % 3 == 1:
-            Player_1.weighted_play(Player_1, deck)
-            
-        if turn_no % 3 == 2:
-            Player_2.weighted_play(Player_2, deck)
-            
-        if turn_no % 3 == 0:
-            Player_3.weighted_play(Player_3, deck)
+    while not game.done:
+        player = game.players[game.current_player]
+        game.step(plays[game.current_player](player, game))
             
     else:
-        P1_total = Player_1.point_tally()
-        P2_total = Player_2.point_tally()
-        P3_total = Player_3.point_tally()
+        totals = game.points()
         
-        print(f'{Player_1.name} has a final score of ' + str(P1_total))
-        print(f'{Player_2.name} has a final score of ' + str(P2_total))
-        print(f'{Player_3.name} has a final score of ' + str(P3_total))
+        for player, total in zip(players, totals):
+            print(f'{player.name} has a final score of ' + str(total))
         
-        if min(P1_total, P2_total, P3_total) == P1_total:
-            print(f'{Player_1.name} has won!!!')
-            
-        elif min(P1_total, P2_total, P3_total) == P2_total:
-             print(f'{Player_2.name} has won!!!')
-         
-        elif min(P1_total, P2_total, P3_total) == P3_total:
-             print(f'{Player_3.name} has won!!!')
-            
+        winner = players[totals.index(min(totals))]
+        print(f'{winner.name} has won!!!')
+
+
+# 4. Batched game
+# ----------------------------------------------------------------------------
+
+NUM_CARDS = 36          # observation width, cards are numbered 3..35
+DECK_SIZE = 24          # cards left after removing 9 of the 33 at random
+CARD_RANGE = np.arange(NUM_CARDS, dtype=np.int64)
+
+
+def hand_bits(hands):
+    # Expand bitmask hands (any shape) into 0/1 arrays with a trailing card axis
+    return (hands[..., None] >> CARD_RANGE) & 1
+
+
+# CHUNK_POINTS[k][c] is the sum of the cards set in c, a 12 bit chunk of a
+# bitmask holding cards 12 * k and up
+_chunk_bits = (np.arange(1 << 12)[:, None] >> np.arange(12)) & 1
+CHUNK_POINTS = [_chunk_bits @ np.arange(shift, shift + 12) for shift in (0, 12, 24)]
+
+
+def card_points(hands):
+    # Sum of the lowest card of every run, for bitmask hands of any shape,
+    # by table lookups of the run starts 12 cards at a time
+    run_starts = hands & ~(hands << 1)
+    return (CHUNK_POINTS[0][run_starts & 0xFFF] + CHUNK_POINTS[1][(run_starts >> 12) & 0xFFF]
+            + CHUNK_POINTS[2][run_starts >> 24])
+
+
+def chip_weights(chip_count):
+    # Vectorised Player.chip_weight
+    weight = (-4/55) * chip_count**2 + (-51/55) * chip_count + 20
+    return np.maximum(weight, 0)
+
+
+# Opponent policies for VecNTEnv. Each takes arrays of bitmask hands, chips,
+# card_pool and chip_pool (one entry per deciding player) plus a
+# numpy.random.Generator, and returns a bool array, True to take.
+
+def weighted_policy(hands, chips, card_pool, chip_pool, rng=None):
+    # Vectorised Player.weighted_play
+    take_chips = chips + chip_pool
+    pass_chips = chips - 1
+    take_value = card_points(hands | (np.int64(1) << card_pool)) - chip_weights(take_chips) * take_chips
+    pass_value = card_points(hands) - chip_weights(pass_chips) * pass_chips
+    return (take_value <= pass_value) | (chips == 0)
+
+
+def random_policy(hands, chips, card_pool, chip_pool, rng):
+    # Vectorised Player.rand_play
+    return rng.integers(2, size=len(chips)) == 0
+
+
+def combine_policy(hands, chips, card_pool, chip_pool, rng, prob=0.5):
+    # Vectorised Player.combine_play: weighted_policy with probability prob,
+    # random_policy otherwise
+    weighted = rng.random(len(chips)) < prob
+    return np.where(weighted, weighted_policy(hands, chips, card_pool, chip_pool),
+                    random_policy(hands, chips, card_pool, chip_pool, rng))
+
+
+def should_take_batch(info):
+    # should_take for every game of a VecNTEnv.step info at once
+    card_pool = info['card_pool']
+    rows = np.arange(len(card_pool))
+    return info['valued_cards'][rows, card_pool] | (card_pool <= info['chip_pool'])
+
+
+class VecNTEnv():
+    """
+    num_envs games of No Thanks! held as NumPy arrays and advanced together.
+    Hands are bitmasks (bit c set when card c is held), decks are rows of a
+    permutation array read through deck_index. The agent always sits in seat
+    0; the other seats follow opponent_policy (combine_policy with prob by
+    default), which decides for every waiting opponent of every game in one
+    call. opponent_policy may also be a list with one policy per opponent
+    seat. Every call to step leaves each game waiting for the agent, and
+    finished games are reset in place.
+
+    num_players is a player count or a sequence of counts dealt to the envs
+    in turn, so tables of different sizes are stepped together. Player
+    arrays are padded to the largest table; seated marks the real seats,
+    padded ones hold no cards or chips and are never on turn.
+    """
+    def __init__(self, num_envs=1024, num_players=3, prob=0.5, seed=None, opponent_policy=None) -> None:
+        self.num_envs = num_envs
+        counts = np.atleast_1d(num_players)
+        self.table_size = np.resize(counts, num_envs).astype(np.int64)
+        self.num_players = int(self.table_size.max())
+        self.seated = np.arange(self.num_players) < self.table_size[:, None]
+        self.start_chips = np.resize([start_chips(n) for n in counts], num_envs).astype(np.int64)
+        self.prob = prob
+        self.opponent_policy = opponent_policy or functools.partial(combine_policy, prob=prob)
+        self.rng = np.random.default_rng(seed)
+
+        self.hands = np.zeros((num_envs, self.num_players), dtype=np.int64)
+        self.chips = np.zeros((num_envs, self.num_players), dtype=np.int64)
+        self.decks = np.zeros((num_envs, DECK_SIZE), dtype=np.int64)
+        self.deck_index = np.zeros(num_envs, dtype=np.int64)
+        self.card_pool = np.zeros(num_envs, dtype=np.int64)
+        self.chip_pool = np.zeros(num_envs, dtype=np.int64)
+        self.current_player = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self):
+        self._reset(np.arange(self.num_envs))
+        return self.get_obs()
+
+    def _reset(self, idx):
+        # Deal new games into `idx`; a game the opponents finish before the
+        # agent ever gets a turn is dealt again
+        while len(idx):
+            n = len(idx)
+            self.hands[idx] = 0
+            self.chips[idx] = self.seated[idx] * self.start_chips[idx, None]
+            self.decks[idx] = shuffled_decks(self.rng, n)
+            self.card_pool[idx] = self.decks[idx, 0]
+            self.deck_index[idx] = 1
+            self.chip_pool[idx] = 0
+            self.current_player[idx] = self.rng.integers(self.table_size[idx])
+
+            done = np.zeros(self.num_envs, dtype=bool)
+            self._play_opponents(done)
+            idx = np.flatnonzero(done)
+
+    def get_obs(self, idx=slice(None)):
+        # Same layout as NTEnv.get_obs, one row per game
+        hands = self.hands[idx]
+        obs = np.empty((len(hands), 2 * NUM_CARDS + 3))
+        obs[:, :NUM_CARDS] = hand_bits(hands[:, 0])
+        obs[:, NUM_CARDS] = self.chips[idx, 0]
+        obs[:, NUM_CARDS + 1:-2] = hand_bits(np.bitwise_or.reduce(hands[:, 1:], axis=1))
+        obs[:, -2] = self.card_pool[idx]
+        obs[:, -1] = self.chip_pool[idx]
+        return obs
+
+    def points(self, idx=slice(None)):
+        return card_points(self.hands[idx]) - self.chips[idx]
+
+    def _apply(self, idx, seat, take):
+        # Play one take/pass decision for `seat` in each game of `idx` and
+        # return the games whose last card has just been taken
+        t, p = idx[take], seat[take]
+        self.hands[t, p] |= np.int64(1) << self.card_pool[t]
+        self.chips[t, p] += self.chip_pool[t]
+        self.chip_pool[t] = 0
+        # The taker turns over the next card and decides again, unless that
+        # was the last one
+        last = self.deck_index[t] == DECK_SIZE
+        more = t[~last]
+        self.card_pool[more] = self.decks[more, self.deck_index[more]]
+        self.deck_index[more] += 1
+
+        q, s = idx[~take], seat[~take]
+        self.chips[q, s] -= 1
+        self.chip_pool[q] += 1
+        self.current_player[q] = (s + 1) % self.table_size[q]
+        return t[last]
+
+    def _opponent_take(self, idx, seat):
+        # opponent_policy for every (game, seat) pair at once, players out
+        # of chips must take
+        chips = self.chips[idx, seat]
+        if callable(self.opponent_policy):
+            take = self.opponent_policy(self.hands[idx, seat], chips, self.card_pool[idx],
+                                        self.chip_pool[idx], self.rng)
+        else:
+            take = np.zeros(len(idx), dtype=bool)
+            for s, policy in enumerate(self.opponent_policy, 1):
+                m = seat == s
+                if m.any():
+                    take[m] = policy(self.hands[idx[m], s], chips[m], self.card_pool[idx[m]],
+                                     self.chip_pool[idx[m]], self.rng)
+        return take | (chips == 0)
+
+    def _play_opponents(self, done):
+        # Advance every unfinished game until it is the agent's turn again
+        while True:
+            idx = np.flatnonzero((self.current_player != 0) & ~done)
+            if len(idx) == 0:
+                break
+            seat = self.current_player[idx]
+            done[self._apply(idx, seat, self._opponent_take(idx, seat))] = True
+
+    def play_out(self, policy, take=None):
+        # Play every game to its end with policy (an opponent policy)
+        # deciding for all seats; take, a bool array, is the first decision
+        # of each game when given. Games are left finished rather than reset,
+        # returns their final points.
+        done = np.zeros(self.num_envs, dtype=bool)
+        while not done.all():
+            idx = np.flatnonzero(~done)
+            seat = self.current_player[idx]
+            chips = self.chips[idx, seat]
+            if take is None:
+                take = policy(self.hands[idx, seat], chips, self.card_pool[idx], self.chip_pool[idx], self.rng)
+            done[self._apply(idx, seat, take | (chips == 0))] = True
+            take = None
+        return self.points()
+
+    def step(self, actions):
+        # actions: int array of shape (num_envs,), 0 takes and 1 passes
+        actions = np.asarray(actions).reshape(self.num_envs)
+        idx = np.arange(self.num_envs)
+        take = (actions == 0) | (self.chips[:, 0] == 0)
+
+        done = np.zeros(self.num_envs, dtype=bool)
+        done[self._apply(idx, np.zeros_like(idx), take)] = True
+        self._play_opponents(done)
+
+        reward = np.zeros(self.num_envs)
+        obs = self.get_obs()
+        # final_points holds the scores of the games that just ended, 0 for
+        # padded seats
+        info = {'terminal_obs': obs.copy(),
+                'final_points': np.zeros((self.num_envs, self.num_players), dtype=np.int64)}
+        ended = np.flatnonzero(done)
+        if len(ended):
+            points = self.points(ended)
+            info['final_points'][ended] = points
+            best = np.where(self.seated[ended], points, np.iinfo(np.int64).max).min(axis=1)
+            reward[ended] = np.where(points[:, 0] == best, 100, -100)
+            self._reset(ended)
+            obs[ended] = self.get_obs(ended)
+
+        held = self.hands[:, 0]
+        info['valued_cards'] = hand_bits((held << 1) | (held >> 1)).astype(bool)
+        info['card_pool'] = self.card_pool.copy()
+        info['chip_pool'] = self.chip_pool.copy()
+        return obs, reward, done, info
+
+    def close(self):
+        self.reset()
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+    def get_rng_state(self):
+        # JSON-able, for checkpoints; games in progress aren't part of it
+        return {'rng': self.rng.bit_generator.state}
+    def set_rng_state(self, state):
+        self.rng.bit_generator.state = state['rng']
+    def render(self):
+        pass
+
+
 test = False
 if test:
     # Run_Game('Alice', 'Bob', 'Claire')  
@@ -328,7 +759,89 @@ if test:
     done = False
     while not done:
         action = np.random.choice([0,1])
-        obs, r , done, _ = env.step([action])
+        obs, r , done, _ = env.step(action)
         print()
         print(obs, r, done)
         print()
+
+    print("----------------------Test Concurrent Envs----------------------")
+    from concurrent.futures import ThreadPoolExecutor
+
+    def make_run(seed):
+        # An env plus its own action generator, both seeded
+        return NTEnv(seed=seed), random.Random(seed), []
+
+    def play_step(run):
+        env, actions, trace = run
+        obs, r, done, _ = env.step(actions.randint(0, 1))
+        trace.append((obs.tolist(), r, done))
+        if done:
+            trace.append(env.reset().tolist())
+
+    sequential = [make_run(seed) for seed in range(32)]
+    for run in sequential:
+        for t in range(500):
+            play_step(run)
+
+    interleaved = [make_run(seed) for seed in range(32)]
+    with ThreadPoolExecutor(8) as pool:
+        for t in range(500):
+            list(pool.map(play_step, interleaved))
+
+    assert [run[2] for run in sequential] == [run[2] for run in interleaved]
+    print("32 envs stepped from 8 threads match sequential runs")
+
+    print("----------------------Test Clone/Restore----------------------")
+    game = Game([Player("player" + str(i)) for i in range(4)], random.Random(0))
+    for t in range(20):
+        game.step(game.players[game.current_player].combine_play(game))
+    state, rng_state = game.clone(), game.rng.getstate()
+    endings = []
+    for t in range(2):
+        game.restore(state)
+        game.rng.setstate(rng_state)
+        game.play_until(-1, Player.combine_play)
+        endings.append((game.points(), [player.card_hand[:] for player in game.players]))
+    assert endings[0] == endings[1] and game.clone() != state
+    print("Game restored from a clone plays out the same")
+
+    print("----------------------Test Batched Games----------------------")
+
+    class LoggedVecNTEnv(VecNTEnv):
+        # Keeps the deal and decisions of every game to replay them in Game
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.logs = [None] * self.num_envs
+            self.finished = []
+
+        def _apply(self, idx, seat, take):
+            for i, s, k in zip(idx.tolist(), seat.tolist(), take.tolist()):
+                if self.logs[i] is None:
+                    self.logs[i] = (self.decks[i].tolist(), s, [])
+                self.logs[i][2].append(k)
+            ended = super()._apply(idx, seat, take)
+            for i, points in zip(ended.tolist(), self.points(ended).tolist()):
+                self.finished.append((self.logs[i], self.table_size[i], points, self.hands[i].tolist()))
+                self.logs[i] = None
+            return ended
+
+    class FixedDecks:
+        def __init__(self, deck):
+            self.deck = deck
+
+        def next(self):
+            return self.deck
+
+    env = LoggedVecNTEnv(64, (3, 5, 7), seed=0)
+    env.reset()
+    actions = np.random.default_rng(0).integers(2, size=(300, 64))
+    for t in range(300):
+        env.step(actions[t])
+    for (deck, first, takes), table_size, points, hands in env.finished:
+        assert sum(bin(hand).count('1') for hand in hands) == DECK_SIZE
+        game = Game([Player("player" + str(i)) for i in range(table_size)], first_player=first,
+                    decks=FixedDecks(deck))
+        for take in takes:
+            game.step(take)
+        assert game.done and game.points() == points[:table_size]
+    print(len(env.finished), "batched games hold 24 cards and replay to the same points in Game")
@@ -13,9 +13,9 @@ class Deck(object):
     def __init__(self):
         self.deck = []
         
-    def build(self):
+    def build(self, rng=random):
         cards_all = range(3,36)
-        deck = random.sample(cards_all, 24)
+        deck = rng.sample(cards_all, 24)
         
         for card in deck:
             self.deck.append(card)
@@ -36,86 +36,61 @@ class Player(object):
     """
     Player consists of a list of cards and number of chips in posession.
     Players can take or pass cards and/or chips. Total points to player at any
-    time can be calculated.
+    time can be calculated. The hand is also kept as a bitmask (bit c set when
+    card c is held) with its card points updated on every take, so scoring a
+    hand or a candidate card is constant time.
     """
     
     def __init__(self, name):
         self.name = name
         self.card_hand = list()
+        self.hand_bits = 0
+        self.card_points = 0
         self.chip_hand = 11
         
-    def draw_card(self, deck, player):
-        global card_pool
-        
-        card_pool = deck.draw()
-        print(f'{self.name} draws the number ' + str(card_pool) + ".")
-        
-        player.weighted_play(player, deck)
+    def draw_card(self, game):
+        game.card_pool = game.deck.draw()
+        print(f'{self.name} draws the number ' + str(game.card_pool) + ".")
     
-    def take_card(self, player, deck):
-        global card_pool
-        global chip_pool
-        global game_end
+    def take_card(self, game):
+        self.add_card(game.card_pool)
+        self.chip_hand += game.chip_pool
         
-        self.card_hand.append(card_pool)
-        self.chip_hand += chip_pool
-        
-        print(f'{self.name} takes the ' + str(card_pool) + " and " + str(chip_pool) + " chips.")
+        print(f'{self.name} takes the ' + str(game.card_pool) + " and " + str(game.chip_pool) + " chips.")
         print(f'{self.name} has ' + str(self.chip_hand) + ' chips remaining.')
         
-        chip_pool = 0
-        
-        if not deck.check_end():
-            player.draw_card(deck, player)
-        else:
-            game_end = True
-        
-    def pass_card(self):
-        
-        global card_pool
-        global chip_pool
+        game.chip_pool = 0
         
+    def pass_card(self, game):
         self.chip_hand -= 1
-        chip_pool += 1
+        game.chip_pool += 1
         
-        print(f'{self.name} passes the ' + str(card_pool) + " and loses a chip.")
+        print(f'{self.name} passes the ' + str(game.card_pool) + " and loses a chip.")
         print(f'{self.name} has ' + str(self.chip_hand) + ' chips remaining.')
         
-    def rand_play(self, player, deck):
+    def rand_play(self, game):
         """
-        Action is randomly determined. Note that players must take a card if
-        they are out of chips.
+        Action is randomly determined, True means take. Note that players must
+        take a card if they are out of chips.
         """
-        global chip_pool
-        decision = random.randint(0,1)
-        
-        
-        if self.chip_hand == 0:
-            decision == 0
-        
-        if decision == 0:
-            player.take_card(player, deck)
-            
-        if decision == 1:
-            player.pass_card()
-            
-    def remove_runs(player_hand):
-        player_hand.sort()
-        player_hand.reverse()
-        remove_list = []
-        
-        for i in player_hand:
-            if i-1 in player_hand:
-                remove_list.append(i)
-
-        for i in remove_list:
-            player_hand.remove(i)
+        return game.rng.randint(0,1) == 0 or self.chip_hand <= 0
             
-        return player_hand
+    def add_card(self, card):
+        self.card_points = self.score_if_taken(card)
+        self.hand_bits |= 1 << card
+        self.card_hand.append(card)
+    
+    def score_if_taken(self, card):
+        # Only the smallest card of a consecutive row counts, so taking card
+        # depends only on whether card-1 and card+1 are held
+        below = (self.hand_bits << 1) >> card & 1
+        above = self.hand_bits >> (card + 1) & 1
+        if below:
+            return self.card_points - (card + 1) * above
+        return self.card_points + card - (card + 1) * above
     
     def point_tally(self):
-        self.card_hand = Player.remove_runs(self.card_hand)
-        card_points = sum(self.card_hand)
+        card_points = self.card_points
         chip_points = self.chip_hand
         return card_points - chip_points
     
@@ -125,26 +100,17 @@ class Player(object):
         return 0.2*chip_count + 0.8
         
     
-    def weighted_play(self, player, deck):
-        global card_pool
-        global chip_pool
-        
-        take_card_hand = Player.remove_runs(self.card_hand + [card_pool])
-        take_chip_hand = self.chip_hand + chip_pool
-        pass_card_hand = Player.remove_runs(self.card_hand)
+    def weighted_play(self, game):
+        take_chip_hand = self.chip_hand + game.chip_pool
         pass_chip_hand = self.chip_hand - 1
         
-        take_value = sum(take_card_hand) - (Player.chip_weight(take_chip_hand) / 2) * take_chip_hand
-        pass_value = sum(pass_card_hand) - Player.chip_weight(pass_chip_hand) * pass_chip_hand
+        take_value = self.score_if_taken(game.card_pool) - (Player.chip_weight(take_chip_hand) / 2) * take_chip_hand
+        pass_value = self.card_points - Player.chip_weight(pass_chip_hand) * pass_chip_hand
         
         # print('take_value is '+str(take_value)+' and pass_value is '+str(pass_value))
         
         
-        if take_value <= pass_value or self.chip_hand <=0:
-            player.take_card(player, deck)
-            
-        else:
-            player.pass_card()
+        return take_value <= pass_value or self.chip_hand <=0
             
         
         
@@ -155,6 +121,42 @@ class Player(object):
 # 3. Game
 # ----------------------------------------------------------------------------
 
+class Game(object):
+    """
+    Game holds the state of one game: the players, the deck, the card on
+    offer (card_pool), the chips on it (chip_pool), whose decision it is
+    (current_player), how many cards have been turned over (deck_index),
+    whether the last card has been taken (game_end) and the random generator
+    used for shuffling and random play. Each call to step plays one decision.
+    """
+    
+    def __init__(self, players, rng=random, first_player=0):
+        self.players = players
+        self.rng = rng
+        self.deck = Deck()
+        self.deck.build(rng)
+        self.chip_pool = 0
+        self.game_end = False
+        self.current_player = first_player
+        self.players[first_player].draw_card(self)
+        self.deck_index = 1
+        
+    def step(self, take):
+        # The taker turns over the next card and decides again, a pass
+        # moves the turn to the next player
+        player = self.players[self.current_player]
+        if take:
+            player.take_card(self)
+            if self.deck.check_end():
+                self.game_end = True
+            else:
+                player.draw_card(self)
+                self.deck_index += 1
+        else:
+            player.pass_card(self)
+            self.current_player = (self.current_player + 1) % len(self.players)
+
+
 def Run_Game(player_1, player_2, player_3):
     """
     A game reflects an iteration of turns, until the deck emtpies and total
@@ -166,44 +168,16 @@ def Run_Game(player_1, player_2, player_3):
     Player_2 = Player(player_2)
     Player_3 = Player(player_3)
 
-    deck = Deck()
-    deck.build()
-    turn_no = 1
-    global card_pool
-    global chip_pool 
-    global game_end
-    """
-    Global used as card_pool and chip_pool need to be updated each turn so
-    cannot be reset between function calls.
-    """
-    card_pool = 0
-    chip_pool = 0
-    game_end = False
+    players = [Player_1, Player_2, Player_3]
     random_start = True
     if random_start:
-        turn_no = random.randint(1, 3)
-        if turn_no == 1:
-            Player_1.draw_card(deck, Player_1)
-        elif turn_no == 2:
-            Player_2.draw_card(deck, Player_2)
-        elif turn_no == 3:
-            Player_3.draw_card(deck, Player_3)
-    
+        game = Game(players, first_player=random.randint(0, 2))
     else:
-        turn_no = 1
-        Player_1.draw_card(deck, Player_1)
+        game = Game(players)
     
-    while not game_end:
-        turn_no += 1
-        
-        if turn_no % 3 == 1:
-            Player_1.weighted_play(Player_1, deck)
-            
-        if turn_no % 3 == 2:
-            Player_2.weighted_play(Player_2, deck)
-            
-        if turn_no % 3 == 0:
-            Player_3.weighted_play(Player_3, deck)
+    while not game.game_end:
+        player = game.players[game.current_player]
+        game.step(player.weighted_play(game))
             
     else:
         P1_total = Player_1.point_tally()
@@ -222,5 +196,7 @@ def Run_Game(player_1, player_2, player_3):
          
         elif min(P1_total, P2_total, P3_total) == P3_total:
              print(f'{Player_3.name} has won!!!')
-            
-Run_Game('Alice', 'Bob', 'Claire')  
+
+
+if __name__ == '__main__':
+    Run_Game('Alice', 'Bob', 'Claire')
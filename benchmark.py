@@ -0,0 +1,175 @@
+import json
+import random
+import time
+import traceback
+
+import click
+import numpy as np
+
+from NTEnv import NTEnv, VecNTEnv
+from tournament import play_games
+
+
+class NullWriter:
+    # Stands in for SummaryWriter when timing DQN.learn
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+
+def best_time(fn, repeat):
+    # Fastest of repeat runs of fn(), in seconds
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_env_step(num_steps=20000, repeat=3, seed=1):
+    def run():
+        env = NTEnv(seed=seed)
+        actions = random.Random(seed)
+        for t in range(num_steps):
+            _, _, done, _ = env.step(actions.randint(0, 1))
+            if done:
+                env.reset()
+    return num_steps / best_time(run, repeat)
+
+
+def bench_vec_env_step(num_envs=1024, num_steps=200, repeat=3, seed=1):
+    actions = np.random.default_rng(seed).integers(2, size=(num_steps, num_envs))
+
+    def run():
+        env = VecNTEnv(num_envs, seed=seed)
+        env.reset()
+        for t in range(num_steps):
+            env.step(actions[t])
+    return num_envs * num_steps / best_time(run, repeat)
+
+
+def bench_heuristic_games(num_games=5000, repeat=3, seed=1):
+    seats = ['weighted', 'weighted', 'weighted']
+    return num_games / best_time(lambda: play_games(seats, num_games, seed), repeat)
+
+
+def bench_rollout_games(num_games=20, repeat=3, seed=1):
+    seats = ['rollout', 'weighted', 'weighted']
+    return num_games / best_time(lambda: play_games(seats, num_games, seed), repeat)
+
+
+def bench_replay_update(num_updates=500, batch_size=128, repeat=3, seed=1):
+    import torch
+    import torch.optim as optim
+    from total_util import dqn_step, QNet_dqn, device
+    from replay import ReplayBuffer
+
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    size = 100000
+    memory = ReplayBuffer(size=size)
+    # One stream of episodes of about 20 steps, every next_state is the
+    # following state so the memory links as it does in training
+    states = rng.random((size + 1, 75))
+    memory.push_batch(states[:-1], rng.integers(2, size=size), rng.choice([0., 100., -100.], size),
+                      states[1:], (rng.random(size) >= 0.05).astype(np.float32))
+    value_net = QNet_dqn(75, 2).to(device)
+    value_net_target = QNet_dqn(75, 2).to(device)
+    optimizer = optim.Adam(value_net.parameters(), lr=1e-3)
+
+    def run():
+        for t in range(num_updates):
+            batch = memory.sample(batch_size)
+            dqn_step(value_net, optimizer, value_net_target,
+                     torch.from_numpy(batch.state).to(device), torch.from_numpy(batch.action).to(device),
+                     torch.from_numpy(batch.reward).to(device), torch.from_numpy(batch.next_state).to(device),
+                     torch.from_numpy(batch.mask).to(device), 0.99)
+    return num_updates / best_time(run, repeat)
+
+
+def bench_learn_iter(step_per_iter=1000, num_iter=3, seed=1):
+    # Seconds per DQN.learn iteration once updates have started
+    from dqn import DQN
+
+    dqn = DQN("MountainCar-v0", memory_size=100000, explore_size=step_per_iter, step_per_iter=step_per_iter,
+              min_update_step=step_per_iter, seed=seed)
+    writer = NullWriter()
+    dqn.learn(writer, 1)
+    start = time.perf_counter()
+    for i_iter in range(2, num_iter + 2):
+        dqn.learn(writer, i_iter)
+    return (time.perf_counter() - start) / num_iter
+
+
+# name: (function, unit, higher is better)
+BENCHMARKS = {
+    'env_step': (bench_env_step, 'steps/s', True),
+    'vec_env_step': (bench_vec_env_step, 'steps/s', True),
+    'heuristic_games': (bench_heuristic_games, 'games/s', True),
+    'rollout_games': (bench_rollout_games, 'games/s', True),
+    'replay_update': (bench_replay_update, 'updates/s', True),
+    'learn_iter': (bench_learn_iter, 's/iter', False),
+}
+
+
+def run_benchmark(name, seed=1):
+    fn, unit, higher_is_better = BENCHMARKS[name]
+    return {'value': fn(seed=seed), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Relative change of every benchmark present in both runs, positive when
+    faster. A benchmark is flagged as a regression when it is slower than
+    the baseline by more than tolerance.
+    """
+    report = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], result['value']
+        change = (new - old) / old if result['higher_is_better'] else (old - new) / old
+        report[name] = {'baseline': old, 'value': new, 'change': change, 'regression': change < -tolerance}
+    return report
+
+
+@click.command()
+@click.option("--bench", type=str, default=None, help="Comma separated benchmarks to run, all by default")
+@click.option("--output", type=str, default=None, help="Write the results as JSON to this file")
+@click.option("--baseline", type=str, default=None, help="JSON results of an earlier run to compare against")
+@click.option("--tolerance", type=float, default=0.15, help="Relative slowdown reported as a regression")
+@click.option("--seed", type=int, default=1, help="Seed for reproducing")
+def main(bench, output, baseline, tolerance, seed):
+    names = bench.split(',') if bench else list(BENCHMARKS)
+    # Every result is printed and written as soon as it is in, and a
+    # benchmark that fails is reported and skipped, so the others are kept
+    results = {}
+    failed = []
+    for name in names:
+        try:
+            results[name] = run_benchmark(name, seed)
+        except Exception:
+            traceback.print_exc()
+            print(f"{name:<16} failed")
+            failed.append(name)
+            continue
+        print(f"{name:<16} {results[name]['value']:12.3f} {results[name]['unit']}", flush=True)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            report = compare(results, json.load(f), tolerance)
+        for name, row in report.items():
+            flag = "REGRESSION" if row['regression'] else ""
+            print(f"{name:<16} {row['baseline']:12.3f} -> {row['value']:12.3f} ({row['change']:+.1%}) {flag}")
+        if any(row['regression'] for row in report.values()):
+            raise SystemExit(1)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Pickle-free checkpoint pieces: tensors go to .npz/.npy files and everything
+# else to JSON, so loading never unpickles anything.
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+
+
+def save_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state_dict(path, state_dict):
+    np.savez(path, **{name: tensor.detach().cpu().numpy() for name, tensor in state_dict.items()})
+
+
+def load_state_dict(path, device='cpu'):
+    with np.load(path, allow_pickle=False) as arrays:
+        return {name: torch.from_numpy(arrays[name]).to(device) for name in arrays.files}
+
+
+def save_optimizer(path, optimizer):
+    # Per-parameter state tensors to <path>.npz, the rest to <path>.json
+    state_dict = optimizer.state_dict()
+    tensors = {}
+    scalars = {}
+    for idx, state in state_dict['state'].items():
+        for name, value in state.items():
+            if torch.is_tensor(value):
+                tensors[f"{idx}.{name}"] = value.detach().cpu().numpy()
+            else:
+                scalars[f"{idx}.{name}"] = value
+    np.savez(path + '.npz', **tensors)
+    save_json(path + '.json', {'param_groups': state_dict['param_groups'], 'scalars': scalars})
+
+
+def load_optimizer(path, optimizer, device='cpu'):
+    meta = load_json(path + '.json')
+    state = {}
+    with np.load(path + '.npz', allow_pickle=False) as arrays:
+        for key in arrays.files:
+            idx, name = key.split('.', 1)
+            state.setdefault(int(idx), {})[name] = torch.from_numpy(arrays[key]).to(device)
+    for key, value in meta['scalars'].items():
+        idx, name = key.split('.', 1)
+        state.setdefault(int(idx), {})[name] = value
+    optimizer.load_state_dict({'state': state, 'param_groups': meta['param_groups']})
+
+
+def save_rng(path):
+    # Global NumPy and torch generator states
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    np.savez(path + '.npz', numpy_keys=keys, torch_state=torch.get_rng_state().numpy())
+    save_json(path + '.json', {'name': name, 'pos': pos, 'has_gauss': has_gauss,
+                               'cached_gaussian': cached_gaussian})
+
+
+def load_rng(path):
+    meta = load_json(path + '.json')
+    with np.load(path + '.npz', allow_pickle=False) as arrays:
+        np.random.set_state((meta['name'], arrays['numpy_keys'], meta['pos'], meta['has_gauss'],
+                             meta['cached_gaussian']))
+        torch.set_rng_state(torch.from_numpy(arrays['torch_state']))
+
+
+def replace_dir(tmp_path, path):
+    # Swap a fully written checkpoint into place
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
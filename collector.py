@@ -0,0 +1,130 @@
+import copy
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from total_util import FLOAT
+from NTEnv import NTEnv, should_take, seed_stream, float_obs
+
+
+def collect_samples(pid, conn, policy_net, num_actions, epsilon, seed, num_players=3, obs_mode='float32'):
+    """
+    Worker loop: owns one NTEnv and answers every (chunk, num_steps,
+    explore, weights) request on conn with that many transitions,
+    continuing the current episode across requests. policy_net is the
+    worker's own copy, loaded with weights whenever a request carries them.
+    The env uses stream pid of seed and the exploration draws of a chunk
+    stream chunk of it, so a worker's games don't depend on how many
+    workers run next to it. num_players is a player count or a sequence
+    of counts played in turn, one episode each, starting from count pid.
+    Observations are sent in NTEnv obs_mode.
+    """
+    torch.set_num_threads(1)
+    env_seed = seed_stream(seed, pid)
+    counts = np.atleast_1d(num_players)
+    episodes = pid
+    env = NTEnv(int(counts[episodes % len(counts)]), seed=env_seed, obs_mode=obs_mode)
+    state = env.reset()
+    info = None
+    episode_reward = 0
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        chunk, num_steps, explore, weights = request
+        if weights is not None:
+            policy_net.load_state_dict({name: torch.from_numpy(weight) for name, weight in weights.items()})
+        rng = np.random.default_rng(seed_stream(env_seed, 2, chunk))
+        states, actions, rewards, next_states, masks = [], [], [], [], []
+        episode_rewards = []
+        for t in range(num_steps):
+            if explore:
+                action = rng.integers(2)
+            elif info is not None and should_take(info):
+                action = 0
+            elif rng.random() <= epsilon:
+                with torch.no_grad():
+                    action = policy_net.get_action(FLOAT(float_obs(state)).unsqueeze(0))
+                action = action.numpy()[0]
+            else:
+                action = rng.integers(num_actions)
+
+            next_state, reward, done, info = env.step(action)
+            states.append(state)
+            actions.append(action)
+            rewards.append(reward)
+            next_states.append(next_state)
+            masks.append(0 if done else 1)
+
+            episode_reward += reward
+            if done:
+                episode_rewards.append(episode_reward)
+                episode_reward = 0
+                episodes += 1
+                env.num_players = int(counts[episodes % len(counts)])
+                state = env.reset()
+                info = None
+            else:
+                state = next_state
+
+        conn.send((np.stack(states), np.array(actions), np.array(rewards),
+                   np.stack(next_states), np.array(masks), episode_rewards))
+    conn.close()
+
+
+class Collector:
+    """
+    Pool of num_process workers running collect_samples. Chunks are handed
+    out round-robin by request() and taken back in the same order by
+    receive(), so worker chunk % num_process always plays chunk and the
+    transitions don't depend on which worker happens to finish first.
+    sync() takes a snapshot of the weights, which goes out with the next
+    request of every worker: chunk is played with the weights of the last
+    sync before it was requested. num_players is a player count or a
+    sequence of counts every worker rotates through.
+    """
+    def __init__(self, value_net, num_process, num_actions, epsilon, seed, num_players=3, obs_mode='float32'):
+        self.conns = []
+        self.workers = []
+        self.weights = None
+        self.stale = [False] * num_process
+        self.requested = 0
+        self.received = 0
+        for pid in range(num_process):
+            conn, worker_conn = mp.Pipe()
+            policy_net = copy.deepcopy(value_net).cpu()
+            worker = mp.Process(target=collect_samples,
+                                args=(pid, worker_conn, policy_net, num_actions, epsilon, seed, num_players,
+                                      obs_mode),
+                                daemon=True)
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def sync(self, value_net):
+        # Copied now, as the value net keeps changing until it is sent
+        self.weights = {name: tensor.cpu().numpy().copy() for name, tensor in value_net.state_dict().items()}
+        self.stale = [True] * len(self.conns)
+
+    def request(self, num_steps, explore):
+        # Hands the next chunk to its worker
+        pid = self.requested % len(self.conns)
+        weights = self.weights if self.stale[pid] else None
+        self.stale[pid] = False
+        self.conns[pid].send((self.requested, num_steps, explore, weights))
+        self.requested += 1
+
+    def receive(self):
+        # Blocks until the oldest chunk not received yet is ready, returns
+        # (pid, chunk)
+        pid = self.received % len(self.conns)
+        self.received += 1
+        return pid, self.conns[pid].recv()
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
@@ -1,4 +1,7 @@
+import functools
+import os
 import pickle
+import time
 
 import numpy as np
 import torch
@@ -6,12 +9,49 @@ import torch.optim as optim
 
 from total_util import dqn_step
 from total_util import QNet_dqn
-from total_util import Memory
 from total_util import get_env_info
 from total_util import check_path
-from total_util import device, FLOAT, LONG
+from total_util import device, FLOAT
 from total_util import ZFilter
-from NTEnv import NTEnv
+from NTEnv import NTEnv, VecNTEnv, should_take, should_take_batch, seed_stream, pack_obs, float_obs, VEC_ENV_STREAM, \
+    EVAL_STREAM, RESUME_STREAM
+from collector import Collector
+from replay import ReplayBuffer, PrioritizedReplayBuffer
+from timing import PhaseTimer, NullTimer
+from inference import save_numpy_model
+from evaluation import evaluate_batched
+from trajectory import TrajectoryReader, iter_transitions
+from checkpoint import save_json, load_json, save_state_dict, load_state_dict, save_optimizer, load_optimizer, \
+    save_rng, load_rng, replace_dir
+
+
+def prioritized_dqn_step(value_net, optimizer_value, value_net_target, states, actions, rewards, next_states,
+                         masks, gamma, weights):
+    """dqn_step with the squared TD error of each sample scaled by its importance sampling weight"""
+    q_values = value_net(states).gather(1, actions.unsqueeze(1)).squeeze(1)
+    with torch.no_grad():
+        q_target_next_values = value_net_target(next_states).max(1)[0]
+        q_target_values = rewards + gamma * masks * q_target_next_values
+    td_errors = q_target_values - q_values
+    value_loss = (weights * td_errors.pow(2)).mean()
+
+    optimizer_value.zero_grad()
+    value_loss.backward()
+    optimizer_value.step()
+
+    return {"critic_loss": value_loss, "td_errors": td_errors.detach()}
+
+
+def learn_log(num_steps, num_updates, episode_rewards):
+    """DQN.learn log of an iteration from the rewards of the episodes it finished"""
+    total_reward = sum(episode_rewards)
+    return {'num_steps': num_steps,
+            'num_updates': num_updates,
+            'num_episodes': len(episode_rewards),
+            'total_reward': total_reward,
+            'avg_reward': total_reward / max(len(episode_rewards), 1),
+            'max_episode_reward': max(episode_rewards, default=0),
+            'min_episode_reward': min(episode_rewards, default=0)}
 
 
 class DQN:
@@ -19,6 +59,8 @@ class DQN:
                  env_id,
                  render=False,
                  num_process=1,
+                 num_envs=1,
+                 num_players=3,
                  memory_size=1000000,
                  explore_size=10000,
                  step_per_iter=3000,
@@ -29,12 +71,29 @@ class DQN:
                  epsilon=0.90,
                  update_target_gap=50,
                  seed=1,
-                 model_path=None
+                 model_path=None,
+                 prioritized=False,
+                 alpha=0.6,
+                 beta=0.4,
+                 timing=False,
+                 async_mode=False,
+                 update_ratio=1.0,
+                 n_step=1,
+                 obs_mode='float32',
+                 eval_games=2000,
+                 eval_opponents=('combine:0.5', 'weighted')
                  ):
         self.env_id = env_id
         self.render = render
         self.num_process = num_process
-        self.memory = Memory(size=memory_size)
+        self.num_envs = num_envs
+        self.num_players = num_players
+        # 'packed' stores observations 12 bytes each in the replay memory
+        self.obs_mode = obs_mode
+        if prioritized:
+            self.memory = PrioritizedReplayBuffer(size=memory_size, alpha=alpha, beta=beta, n_step=n_step, gamma=gamma)
+        else:
+            self.memory = ReplayBuffer(size=memory_size, n_step=n_step, gamma=gamma)
         self.explore_size = explore_size
         self.step_per_iter = step_per_iter
         self.lr_q = lr_q
@@ -45,6 +104,19 @@ class DQN:
         self.epsilon = epsilon
         self.seed = seed
         self.model_path = model_path
+        self.collector = None
+        self.collector_seed = seed
+        self.vec_env = None
+        self.vec_env_rng = None
+        self.timer = PhaseTimer() if timing else NullTimer()
+        self.async_mode = async_mode
+        self.update_ratio = update_ratio
+        self.eval_games = eval_games
+        self.eval_opponents = eval_opponents
+        self.update_budget = 0.0
+        self.num_updates = 0
+        self.serial_episodes = 0
+        self.i_iter = 0
 
         self._init_model()
 
@@ -53,15 +125,16 @@ class DQN:
         self.env, env_continuous, num_states, self.num_actions = get_env_info(
             self.env_id)
         assert not env_continuous, "DQN is only applicable to discontinuous environment !!!!"
-        self.env = NTEnv()
+        # Same stream as collector worker 0, so serial and parallel runs share their first env
+        self.env = NTEnv(int(np.atleast_1d(self.num_players)[0]), seed=seed_stream(self.seed, 0),
+                         obs_mode=self.obs_mode)
         env_continuous = False
         obs = self.env.reset()
-        num_states = obs.shape[0]
+        num_states = self.num_states = float_obs(obs).shape[0]
         self.num_actions = 2
         # seeding
         np.random.seed(self.seed)
         torch.manual_seed(self.seed)
-        # self.env.seed(self.seed)
 
         # initialize networks
         self.value_net = QNet_dqn(num_states, self.num_actions).to(device)
@@ -71,7 +144,12 @@ class DQN:
         self.running_state = ZFilter((num_states,), clip=5)
 
         # load model if necessary
-        if self.model_path:
+        if self.model_path and os.path.isdir('{}/{}_dqn'.format(self.model_path, self.env_id)):
+            print("Loading Saved Model {}_dqn".format(self.env_id))
+            self.value_net.load_state_dict(load_state_dict(
+                '{}/{}_dqn/value_net.npz'.format(self.model_path, self.env_id), device))
+        elif self.model_path:
+            # Models saved before checkpoints were pickle-free
             print("Loading Saved Model {}_dqn.p".format(self.env_id))
             self.value_net, self.running_state = pickle.load(
                 open('{}/{}_dqn.p'.format(self.model_path, self.env_id), "rb"))
@@ -81,7 +159,7 @@ class DQN:
         self.optimizer = optim.Adam(self.value_net.parameters(), lr=self.lr_q)
 
     def choose_action(self, state):
-        state = FLOAT(state).unsqueeze(0).to(device)
+        state = FLOAT(float_obs(state)).unsqueeze(0).to(device)
         if np.random.uniform() <= self.epsilon:
             with torch.no_grad():
                 action = self.value_net.get_action(state)
@@ -90,75 +168,131 @@ class DQN:
             action = np.random.randint(0, self.num_actions)
         return action
 
-    def eval(self, i_iter, render=False):
-        """evaluate model"""
-        state = self.env.reset()
-        test_reward = 0
-        while True:
-            if render:
-                self.env.render()
-            # state = self.running_state(state)
-            action = self.choose_action(state)
-            state, reward, done, _ = self.env.step(action)
+    def _stored(self, obs):
+        # Float observations in the format of obs_mode for the replay memory
+        return pack_obs(obs) if self.obs_mode == 'packed' else obs
 
-            test_reward += reward
-            if done:
-                break
-        print(f"Iter: {i_iter}, test Reward: {test_reward}")
-        self.env.close()
+    def choose_actions(self, states, epsilon=None):
+        """epsilon-greedy actions for a batch of states from one forward pass, epsilon=1 is greedy"""
+        epsilon = self.epsilon if epsilon is None else epsilon
+        states = torch.from_numpy(np.asarray(states, dtype=np.float32)).to(device)
+        with torch.no_grad():
+            actions = self.value_net.get_action(states).cpu().numpy()
+        explore = np.random.uniform(size=len(actions)) > epsilon
+        actions[explore] = np.random.randint(0, self.num_actions, explore.sum())
+        return actions
+
+    def eval(self, i_iter, writer=None):
+        """
+        greedy play of eval_games batched games against every opponent mix in
+        eval_opponents. The games are seeded with their own stream of
+        self.seed so successive evaluations face the same deals, none of
+        them dealt in training.
+        """
+        greedy = functools.partial(self.choose_actions, epsilon=1)
+        for mix in self.eval_opponents:
+            start = time.perf_counter()
+            result = evaluate_batched(greedy, self.eval_games, mix, self.num_players,
+                                      seed=seed_stream(self.seed, EVAL_STREAM))
+            low, high = result['win_rate_ci']
+            print(f"Iter: {i_iter}, vs {mix}: win rate: {result['win_rate']:.3f} ({low:.3f}-{high:.3f}), "
+                  f"margin: {result['margin']: .2f} +- {result['margin_se']:.2f}, "
+                  f"time: {time.perf_counter() - start:.2f}s")
+            if writer is not None:
+                writer.add_scalar(f"eval/{mix}/win rate", result['win_rate'], i_iter)
+                writer.add_scalar(f"eval/{mix}/win rate low", low, i_iter)
+                writer.add_scalar(f"eval/{mix}/win rate high", high, i_iter)
+                writer.add_scalar(f"eval/{mix}/score margin", result['margin'], i_iter)
 
     def learn(self, writer, i_iter):
         """interact"""
+        self.timer.reset()
+        if self.async_mode:
+            log = self._learn_async(i_iter)
+        elif self.num_process > 1:
+            log = self._learn_parallel(i_iter)
+        elif self.num_envs > 1:
+            log = self._learn_vec(i_iter)
+        else:
+            log = self._learn_serial(i_iter)
+
+        print(f"Iter: {i_iter}, num steps: {log['num_steps']}, total reward: {log['total_reward']: .4f}, "
+              f"min reward: {log['min_episode_reward']: .4f}, max reward: {log['max_episode_reward']: .4f}, "
+              f"average reward: {log['avg_reward']: .4f}")
+
+        # record reward information
+        writer.add_scalar("total reward", log['total_reward'], i_iter)
+        writer.add_scalar("average reward", log['avg_reward'], i_iter)
+        writer.add_scalar("min reward", log['min_episode_reward'], i_iter)
+        writer.add_scalar("max reward", log['max_episode_reward'], i_iter)
+        writer.add_scalar("num steps", log['num_steps'], i_iter)
+        self.i_iter = i_iter
+        self.timer.write(writer, i_iter, log['num_steps'], log['num_updates'])
+
+    def _learn_serial(self, i_iter):
         global_steps = (i_iter - 1) * self.step_per_iter
         log = dict()
         num_steps = 0
+        num_updates = 0
         num_episodes = 0
         total_reward = 0
         min_episode_reward = float('inf')
         max_episode_reward = float('-inf')
 
+        timer = self.timer
         while num_steps < self.step_per_iter:
+            tic = timer.start()
+            # Every count of num_players gets its turn, one episode each
+            counts = np.atleast_1d(self.num_players)
+            self.env.num_players = int(counts[self.serial_episodes % len(counts)])
+            self.serial_episodes += 1
             state = self.env.reset()
+            timer.stop('env_reset', tic)
             # state = self.running_state(state)
             episode_reward = 0
-            info = {}
-            info['valued_cards'] = []
-            info['card_pool'] = -1
-            info['chip_pool'] = -1
+            info = None
             for t in range(10000):
                 if self.render:
                     self.env.render()
 
+                tic = timer.start()
                 if global_steps < self.explore_size:  # explore
                     action = np.random.choice([0, 1])
-                elif info['card_pool'] != -1:
-                    if info['card_pool'] in info['valued_cards'] or \
-                        info['card_pool'] <= info['chip_pool']:
-                        action = 0
-                        # action = self.choose_action(state)
-                    else:
-                        action = self.choose_action(state)
+                elif info is not None and should_take(info):
+                    action = 0
                 else:  # choose according to target net
                     action = self.choose_action(state)
+                timer.stop('choose_action', tic)
 
+                tic = timer.start()
                 next_state, reward, done, info = self.env.step(action)
+                timer.stop('env_step', tic)
                 # next_state = self.running_state(next_state)
                 mask = 0 if done else 1
                 # ('state', 'action', 'reward', 'next_state', 'mask', 'log_prob')
+                tic = timer.start()
                 self.memory.push(state, action, reward, next_state, mask, None)
+                timer.stop('replay_push', tic)
 
                 episode_reward += reward
                 global_steps += 1
                 num_steps += 1
 
                 if global_steps >= self.min_update_step:
+                    tic = timer.start()
                     batch = self.memory.sample(
                         self.batch_size)  # random sample batch
+                    timer.stop('replay_sample', tic)
+                    tic = timer.start()
                     self.update(batch)
+                    timer.stop('dqn_step', tic)
+                    num_updates += 1
 
                 if global_steps % self.update_target_gap == 0:
+                    tic = timer.start()
                     self.value_net_target.load_state_dict(
                         self.value_net.state_dict())
+                    timer.stop('target_sync', tic)
 
                 if done or num_steps >= self.step_per_iter:
                     break
@@ -173,35 +307,285 @@ class DQN:
         self.env.close()
 
         log['num_steps'] = num_steps
+        log['num_updates'] = num_updates
         log['num_episodes'] = num_episodes
         log['total_reward'] = total_reward
         log['avg_reward'] = total_reward / num_episodes
         log['max_episode_reward'] = max_episode_reward
         log['min_episode_reward'] = min_episode_reward
+        return log
 
-        print(f"Iter: {i_iter}, num steps: {log['num_steps']}, total reward: {log['total_reward']: .4f}, "
-              f"min reward: {log['min_episode_reward']: .4f}, max reward: {log['max_episode_reward']: .4f}, "
-              f"average reward: {log['avg_reward']: .4f}")
+    def _learn_vec(self, i_iter):
+        """
+        Step num_envs games together in a VecNTEnv, picking every action of
+        a step with one call to choose_actions. Games carry over between
+        iterations, which end on the first step reaching step_per_iter.
+        """
+        if self.vec_env is None:
+            self.vec_env = VecNTEnv(self.num_envs, self.num_players, seed=seed_stream(self.seed, VEC_ENV_STREAM))
+            if self.vec_env_rng is not None:
+                # Resumed: deal on from where the saved run was
+                self.vec_env.set_rng_state(self.vec_env_rng)
+            self.vec_state = self.vec_env.reset()
+            self.vec_info = None
+            self.vec_episode_reward = np.zeros(self.num_envs)
+        global_steps = (i_iter - 1) * self.step_per_iter
+        num_steps = 0
+        num_updates = 0
+        episode_rewards = []
+        timer = self.timer
 
-        # record reward information
-        writer.add_scalar("total reward", log['total_reward'], i_iter)
-        writer.add_scalar("average reward", log['avg_reward'], i_iter)
-        writer.add_scalar("min reward", log['min_episode_reward'], i_iter)
-        writer.add_scalar("max reward", log['max_episode_reward'], i_iter)
-        writer.add_scalar("num steps", log['num_steps'], i_iter)
+        while num_steps < self.step_per_iter:
+            tic = timer.start()
+            if global_steps < self.explore_size:  # explore
+                actions = np.random.randint(0, self.num_actions, self.num_envs)
+            else:
+                actions = self.choose_actions(self.vec_state)
+                if self.vec_info is not None:
+                    actions[should_take_batch(self.vec_info)] = 0
+            timer.stop('choose_action', tic)
+
+            tic = timer.start()
+            next_states, rewards, dones, self.vec_info = self.vec_env.step(actions)
+            timer.stop('env_step', tic)
+            tic = timer.start()
+            # terminal_obs holds the last observation of games that were reset
+            self.memory.push_batch(self._stored(self.vec_state), actions, rewards,
+                                   self._stored(self.vec_info['terminal_obs']), 1 - dones, np.arange(self.num_envs))
+            timer.stop('replay_push', tic)
+            self.vec_state = next_states
+
+            self.vec_episode_reward += rewards
+            episode_rewards += self.vec_episode_reward[dones].tolist()
+            self.vec_episode_reward[dones] = 0
+
+            for i in range(self.num_envs):
+                global_steps += 1
+                num_steps += 1
+
+                if global_steps >= self.min_update_step:
+                    tic = timer.start()
+                    batch = self.memory.sample(
+                        self.batch_size)  # random sample batch
+                    timer.stop('replay_sample', tic)
+                    tic = timer.start()
+                    self.update(batch)
+                    timer.stop('dqn_step', tic)
+                    num_updates += 1
+
+                if global_steps % self.update_target_gap == 0:
+                    tic = timer.start()
+                    self.value_net_target.load_state_dict(
+                        self.value_net.state_dict())
+                    timer.stop('target_sync', tic)
+
+        return learn_log(num_steps, num_updates, episode_rewards)
+
+    def _learn_async(self, i_iter):
+        """
+        Actor-learner mode: num_process workers keep stepping their envs,
+        each re-requested as soon as it hands in a chunk (chunks still in
+        flight at the end of an iteration count towards the next one).
+        Chunks are learned from in the order they were requested: after
+        each one this process runs update_ratio updates per collected
+        transition while the workers carry on, and syncs the target net and
+        publishes the weights to them every update_target_gap updates.
+        """
+        global_steps = (i_iter - 1) * self.step_per_iter
+        if self.collector is None:
+            self.collector = Collector(self.value_net, self.num_process, self.num_actions,
+                                       self.epsilon, self.collector_seed, self.num_players, self.obs_mode)
+            for _ in range(self.num_process):
+                self.collector.request(self.update_target_gap, global_steps < self.explore_size)
+        num_steps = 0
+        num_updates = 0
+        episode_rewards = []
+        timer = self.timer
+
+        while num_steps < self.step_per_iter:
+            tic = timer.start()
+            pid, (states, actions, rewards, next_states, masks, finished) = self.collector.receive()
+            timer.stop('collector_wait', tic)
+            self.collector.request(self.update_target_gap, global_steps + len(actions) < self.explore_size)
+            tic = timer.start()
+            self.memory.push_batch(states, actions, rewards, next_states, masks, np.full(len(actions), pid))
+            timer.stop('replay_push', tic)
+            episode_rewards += finished
+            global_steps += len(actions)
+            num_steps += len(actions)
+            if global_steps >= self.min_update_step:
+                self.update_budget += self.update_ratio * len(actions)
+
+            while self.update_budget >= 1:
+                tic = timer.start()
+                batch = self.memory.sample(
+                    self.batch_size)  # random sample batch
+                timer.stop('replay_sample', tic)
+                tic = timer.start()
+                self.update(batch)
+                timer.stop('dqn_step', tic)
+                self.update_budget -= 1
+                self.num_updates += 1
+                num_updates += 1
+
+                if self.num_updates % self.update_target_gap == 0:
+                    tic = timer.start()
+                    self.value_net_target.load_state_dict(
+                        self.value_net.state_dict())
+                    self.collector.sync(self.value_net)
+                    timer.stop('target_sync', tic)
+
+        return learn_log(num_steps, num_updates, episode_rewards)
+
+    def _learn_parallel(self, i_iter):
+        """
+        Collect with num_process worker processes, each stepping its own env,
+        while this process pushes their transitions and runs the updates.
+        Workers are handed update_target_gap steps at a time, taken back in
+        the order they were requested, and the policy weights are sent to
+        them whenever the target net is synced.
+        """
+        if self.collector is None:
+            self.collector = Collector(self.value_net, self.num_process, self.num_actions,
+                                       self.epsilon, self.collector_seed, self.num_players, self.obs_mode)
+        global_steps = (i_iter - 1) * self.step_per_iter
+        num_steps = 0
+        num_updates = 0
+        episode_rewards = []
+        timer = self.timer
+
+        requested = 0
+        for _ in range(self.num_process):
+            chunk = min(self.update_target_gap, self.step_per_iter - requested)
+            if chunk > 0:
+                self.collector.request(chunk, global_steps + requested < self.explore_size)
+                requested += chunk
+
+        while num_steps < self.step_per_iter:
+            tic = timer.start()
+            pid, (states, actions, rewards, next_states, masks, finished) = self.collector.receive()
+            timer.stop('collector_wait', tic)
+            # Keep the worker busy while this chunk is learned from
+            chunk = min(self.update_target_gap, self.step_per_iter - requested)
+            if chunk > 0:
+                self.collector.request(chunk, global_steps + requested < self.explore_size)
+                requested += chunk
+
+            episode_rewards += finished
+            for i in range(len(actions)):
+                # ('state', 'action', 'reward', 'next_state', 'mask', 'log_prob')
+                tic = timer.start()
+                self.memory.push(states[i], actions[i], rewards[i], next_states[i], masks[i], None, pid)
+                timer.stop('replay_push', tic)
+                global_steps += 1
+                num_steps += 1
+
+                if global_steps >= self.min_update_step:
+                    tic = timer.start()
+                    batch = self.memory.sample(
+                        self.batch_size)  # random sample batch
+                    timer.stop('replay_sample', tic)
+                    tic = timer.start()
+                    self.update(batch)
+                    timer.stop('dqn_step', tic)
+                    num_updates += 1
+
+                if global_steps % self.update_target_gap == 0:
+                    tic = timer.start()
+                    self.value_net_target.load_state_dict(
+                        self.value_net.state_dict())
+                    self.collector.sync(self.value_net)
+                    timer.stop('target_sync', tic)
+
+        return learn_log(num_steps, num_updates, episode_rewards)
 
     def update(self, batch):
-        batch_state = FLOAT(batch.state).to(device)
-        batch_action = LONG(batch.action).to(device)
-        batch_reward = FLOAT(batch.reward).to(device)
-        batch_next_state = FLOAT(batch.next_state).to(device)
-        batch_mask = FLOAT(batch.mask).to(device)
-
-        alg_step_stats = dqn_step(self.value_net, self.optimizer, self.value_net_target, batch_state, batch_action,
-                                  batch_reward, batch_next_state, batch_mask, self.gamma)
-
-    def save(self, save_path):
-        """save model"""
-        check_path(save_path)
-        pickle.dump((self.value_net, self.running_state),
-                    open('{}/{}_dqn.p'.format(save_path, self.env_id), 'wb'))
+        batch_state = torch.from_numpy(batch.state).to(device)
+        batch_action = torch.from_numpy(batch.action).to(device)
+        batch_reward = torch.from_numpy(batch.reward).to(device)
+        batch_next_state = torch.from_numpy(batch.next_state).to(device)
+        batch_mask = torch.from_numpy(batch.mask).to(device)
+
+        if batch.weight is None:
+            alg_step_stats = dqn_step(self.value_net, self.optimizer, self.value_net_target, batch_state, batch_action,
+                                      batch_reward, batch_next_state, batch_mask, self.gamma)
+        else:
+            batch_weight = torch.from_numpy(batch.weight).to(device)
+            alg_step_stats = prioritized_dqn_step(self.value_net, self.optimizer, self.value_net_target, batch_state,
+                                                  batch_action, batch_reward, batch_next_state, batch_mask,
+                                                  self.gamma, batch_weight)
+            self.memory.update_priorities(batch.index, alg_step_stats["td_errors"].cpu().numpy())
+        return alg_step_stats
+
+    def pretrain(self, data_path, num_updates=10000, batch_size=1024, seats=None, writer=None):
+        """
+        load the transitions of a trajectory dataset (see trajectory.py) into
+        the replay memory, fit value_net to them with num_updates updates of
+        batch_size and hand off to online learning without the random
+        exploration phase
+        """
+        start = time.perf_counter()
+        reader = TrajectoryReader(data_path)
+        for states, actions, rewards, next_states, masks, streams in iter_transitions(reader, seats):
+            self.memory.push_batch(self._stored(states), actions, rewards, self._stored(next_states), masks, streams)
+        print(f"Pretrain: {len(self.memory)} transitions loaded in {time.perf_counter() - start:.1f}s")
+
+        for i in range(1, num_updates + 1):
+            stats = self.update(self.memory.sample(batch_size))
+            if i % self.update_target_gap == 0:
+                self.value_net_target.load_state_dict(self.value_net.state_dict())
+            if i % 1000 == 0 or i == num_updates:
+                loss = stats["critic_loss"].item()
+                print(f"Pretrain: {i} updates, loss: {loss: .4f}, time: {time.perf_counter() - start:.1f}s")
+                if writer is not None:
+                    writer.add_scalar("pretrain loss", loss, i)
+        self.value_net_target.load_state_dict(self.value_net.state_dict())
+        self.explore_size = 0
+        self.min_update_step = 0
+
+    def save(self, save_path, save_replay=True):
+        """
+        save model, target net, optimizer, counters, random states and
+        (unless save_replay is False) the replay memory to <save_path>/<env_id>_dqn
+        """
+        path = '{}/{}_dqn'.format(save_path, self.env_id)
+        tmp_path = path + '.tmp'
+        check_path(tmp_path)
+        save_state_dict(tmp_path + '/value_net.npz', self.value_net.state_dict())
+        save_state_dict(tmp_path + '/value_net_target.npz', self.value_net_target.state_dict())
+        # layer spec so test.py can play with NumPy alone
+        save_numpy_model(tmp_path, self.value_net, self.num_states)
+        save_optimizer(tmp_path + '/optimizer', self.optimizer)
+        save_rng(tmp_path + '/rng')
+        vec_env_rng = self.vec_env.get_rng_state() if self.vec_env is not None else None
+        save_json(tmp_path + '/counters.json', {'i_iter': self.i_iter,
+                                                'num_updates': self.num_updates,
+                                                'update_budget': self.update_budget,
+                                                'serial_episodes': self.serial_episodes,
+                                                'env_rng': self.env.get_rng_state(),
+                                                'vec_env_rng': vec_env_rng})
+        if save_replay:
+            self.memory.save(tmp_path + '/replay')
+        replace_dir(tmp_path, path)
+
+    def load(self, model_path):
+        """resume from a checkpoint written by save, returns the last finished iteration"""
+        path = '{}/{}_dqn'.format(model_path, self.env_id)
+        self.value_net.load_state_dict(load_state_dict(path + '/value_net.npz', device))
+        self.value_net_target.load_state_dict(load_state_dict(path + '/value_net_target.npz', device))
+        load_optimizer(path + '/optimizer', self.optimizer, device)
+        load_rng(path + '/rng')
+        counters = load_json(path + '/counters.json')
+        self.i_iter = counters['i_iter']
+        self.num_updates = counters['num_updates']
+        self.update_budget = counters['update_budget']
+        self.serial_episodes = counters.get('serial_episodes', 0)
+        if 'env_rng' in counters:
+            self.env.set_rng_state(counters['env_rng'])
+        self.vec_env_rng = counters.get('vec_env_rng')
+        # The collector workers' envs aren't saved, they deal from fresh
+        # streams instead of the opening games again
+        self.collector_seed = seed_stream(self.seed, RESUME_STREAM, self.i_iter)
+        if os.path.isdir(path + '/replay'):
+            self.memory.load(path + '/replay')
+        return self.i_iter
@@ -0,0 +1,75 @@
+import functools
+
+import numpy as np
+
+from NTEnv import VecNTEnv, weighted_policy, random_policy, combine_policy, should_take_batch
+from tournament import wilson_interval
+
+# Batched opponent policies by name, the VecNTEnv counterparts of tournament.STRATEGIES
+POLICIES = {
+    'weighted': weighted_policy,
+    'random': random_policy,
+    'combine': combine_policy,
+}
+
+
+def get_policy(spec):
+    # A POLICIES name, 'combine' optionally followed by ':<prob>' (e.g. combine:0.8)
+    name, _, arg = spec.partition(':')
+    policy = POLICIES[name]
+    if arg and name == 'combine':
+        return functools.partial(policy, prob=float(arg))
+    if arg:
+        raise ValueError(f"Policy {name} takes no argument: {spec}")
+    return policy
+
+
+def get_opponents(mix):
+    """
+    Turn an opponent mix into a VecNTEnv opponent_policy. A mix is one
+    policy spec played by every opponent (e.g. combine:0.5) or a comma
+    separated spec per opponent seat (e.g. weighted,random).
+    """
+    specs = mix.split(',')
+    if len(specs) == 1:
+        return get_policy(specs[0])
+    return [get_policy(spec) for spec in specs]
+
+
+def evaluate_batched(act, num_games, mix='combine:0.5', num_players=3, seed=1):
+    """
+    Play num_games games at once in a VecNTEnv against the opponent mix,
+    one game per env; num_players is a count or a sequence of counts dealt
+    to the envs in turn. act maps a batch of observations to actions; the
+    should_take rule overrides it as during training. Returns the win rate
+    with its Wilson interval and the mean score margin (best opponent score
+    minus the agent's, positive when the agent is ahead) with its standard
+    error.
+    """
+    opponents = get_opponents(mix)
+    env = VecNTEnv(num_games, num_players, seed=seed, opponent_policy=opponents)
+    if not callable(opponents) and len(opponents) != env.num_players - 1:
+        raise ValueError(f"Mix {mix} has {len(opponents)} seats for {env.num_players - 1} opponents")
+    obs = env.reset()
+    info = None
+    finished = np.zeros(num_games, dtype=bool)
+    wins = np.zeros(num_games, dtype=bool)
+    margins = np.zeros(num_games)
+    while not finished.all():
+        actions = np.asarray(act(obs.astype(np.float32)))
+        if info is not None:
+            actions[should_take_batch(info)] = 0
+        obs, reward, done, info = env.step(actions)
+        # Only the first game of every env counts, later ones are ignored
+        first = done & ~finished
+        points = np.where(env.seated[first], info['final_points'][first], np.iinfo(np.int64).max)
+        wins[first] = reward[first] > 0
+        margins[first] = points[:, 1:].min(axis=1) - points[:, 0]
+        finished |= done
+
+    num_wins = int(wins.sum())
+    return {'num_games': num_games,
+            'win_rate': num_wins / num_games,
+            'win_rate_ci': wilson_interval(num_wins, num_games),
+            'margin': margins.mean(),
+            'margin_se': margins.std() / np.sqrt(num_games)}
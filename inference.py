@@ -0,0 +1,153 @@
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from NTEnv import NTEnv, should_take, seed_stream, TEST_STREAM
+from tournament import wilson_interval
+
+# Activation modules NumpyQNet can replay, applied to a NumPy array
+ACTIVATIONS = {
+    'ReLU': lambda x, layer: np.maximum(x, 0),
+    'LeakyReLU': lambda x, layer: np.where(x > 0, x, x * layer['negative_slope']),
+    'Tanh': lambda x, layer: np.tanh(x),
+    'Sigmoid': lambda x, layer: 1 / (1 + np.exp(-x)),
+}
+
+
+def describe_layers(net):
+    # Linear and activation modules of net in registration order, or None
+    # if it holds any other kind of layer
+    layers = []
+    for name, module in net.named_modules():
+        kind = type(module).__name__
+        if kind == 'Linear':
+            layers.append({'type': kind, 'weight': name + '.weight', 'bias': name + '.bias'})
+        elif kind in ACTIVATIONS:
+            layers.append({'type': kind, 'negative_slope': getattr(module, 'negative_slope', None)})
+        elif not list(module.children()):
+            return None
+    return layers
+
+
+def save_numpy_model(path, net, num_states):
+    """
+    Write <path>/value_net.json describing net for NumpyQNet, next to the
+    value_net.npz written by DQN.save. It is only written when the NumPy
+    forward pass reproduces the torch one, nets with any other layers
+    fall back to a TorchScript export.
+    """
+    import torch
+
+    layers = describe_layers(net)
+    if layers is None:
+        return False
+    candidates = [layers]
+    if all(layer['type'] == 'Linear' for layer in layers):
+        # Activations applied with torch.nn.functional don't show up as
+        # modules, the usual one is a ReLU after every hidden layer
+        relu = [{'type': 'ReLU'}] * len(layers)
+        candidates.append([layer for pair in zip(layers, relu) for layer in pair][:-1])
+    weights = {name: tensor.detach().cpu().numpy() for name, tensor in net.state_dict().items()}
+    states = np.random.default_rng(0).uniform(0, 35, (64, num_states)).astype(np.float32)
+    with torch.no_grad():
+        expected = net(torch.from_numpy(states).to(next(net.parameters()).device)).cpu().numpy()
+    for layers in candidates:
+        if np.allclose(NumpyQNet(layers, weights)(states), expected, rtol=1e-4, atol=1e-4):
+            with open(os.path.join(path, 'value_net.json'), 'w') as f:
+                json.dump({'layers': layers}, f, indent=2)
+            return True
+    return False
+
+
+def export_torchscript(path, num_states=75, num_actions=2):
+    # Trace the saved Q-network on CPU into <path>/value_net.pt
+    import torch
+    from total_util import QNet_dqn
+    from checkpoint import load_state_dict
+
+    net = QNet_dqn(num_states, num_actions)
+    net.load_state_dict(load_state_dict(os.path.join(path, 'value_net.npz')))
+    net.eval()
+    traced = torch.jit.trace(net, torch.zeros(1, num_states))
+    traced.save(os.path.join(path, 'value_net.pt'))
+
+
+class NumpyQNet:
+    """Q-network forward pass in NumPy from the layers listed by describe_layers"""
+    def __init__(self, layers, weights):
+        self.layers = layers
+        self.weights = weights
+
+    def __call__(self, states):
+        x = states
+        for layer in self.layers:
+            if layer['type'] == 'Linear':
+                x = x @ self.weights[layer['weight']].T + self.weights[layer['bias']]
+            else:
+                x = ACTIVATIONS[layer['type']](x, layer)
+        return x
+
+
+class TorchScriptQNet:
+    # Same call interface around a TorchScript export
+    def __init__(self, path):
+        import torch
+        self.torch = torch
+        self.net = torch.jit.load(path, map_location='cpu')
+
+    def __call__(self, states):
+        with self.torch.no_grad():
+            return self.net(self.torch.from_numpy(states)).numpy()
+
+
+def load_qnet(path):
+    """
+    Q-network of the checkpoint directory path, as NumPy when
+    value_net.json is there (no torch import at all) and otherwise from a
+    TorchScript value_net.pt.
+    """
+    spec = os.path.join(path, 'value_net.json')
+    if os.path.exists(spec):
+        with np.load(os.path.join(path, 'value_net.npz'), allow_pickle=False) as arrays:
+            weights = {name: arrays[name] for name in arrays.files}
+        with open(spec) as f:
+            return NumpyQNet(json.load(f)['layers'], weights)
+    if os.path.exists(os.path.join(path, 'value_net.pt')):
+        return TorchScriptQNet(os.path.join(path, 'value_net.pt'))
+    raise FileNotFoundError(f"No value_net.json or value_net.pt in {path}, export one first")
+
+
+def play_games(path, num_games, seed, num_players=3):
+    # Greedy play of num_games seeded games, returns the final rewards
+    qnet = load_qnet(path)
+    env = NTEnv(num_players, seed=seed, obs_mode='float32')
+    rewards = []
+    for g in range(num_games):
+        state = env.reset()
+        info = None
+        done = False
+        while not done:
+            if info is not None and should_take(info):
+                action = 0
+            else:
+                action = int(qnet(state[None]).argmax())
+            state, reward, done, info = env.step(action)
+        rewards.append(reward)
+    return rewards
+
+
+def evaluate(path, num_games, num_process=1, seed=1, chunk_size=100):
+    """Win rate of the greedy policy over num_games games split across num_process workers"""
+    chunks = [(path, min(chunk_size, num_games - start), seed_stream(seed, TEST_STREAM, c))
+              for c, start in enumerate(range(0, num_games, chunk_size))]
+    if num_process == 1:
+        rewards = [play_games(*chunk) for chunk in chunks]
+    else:
+        with Pool(num_process) as pool:
+            rewards = pool.starmap(play_games, chunks)
+    rewards = np.concatenate(rewards)
+    wins = int((rewards > 0).sum())
+    return {'num_games': len(rewards), 'win_rate': wins / len(rewards),
+            'win_rate_ci': wilson_interval(wins, len(rewards))}
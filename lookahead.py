@@ -0,0 +1,79 @@
+import functools
+import time
+
+import numpy as np
+
+from NTEnv import DECK_SIZE, VecNTEnv, combine_policy
+
+ALL_CARDS = np.arange(3, 36)
+# Plays every seat of a rollout. Some randomness makes for a better
+# lookahead than deterministic weighted_policy rollouts.
+ROLLOUT_POLICY = functools.partial(combine_policy, prob=0.8)
+
+
+def rollout_games(state, num_rollouts, rng, peek=False):
+    """
+    A VecNTEnv holding 2 * num_rollouts copies of a GameState (see
+    Game.clone), the first half to take the card on offer and the second to
+    pass it. The player to move doesn't know the cards still to come, so
+    unless peek each rollout deals them again from the cards not seen yet;
+    its take and pass copies share the deal and only differ by the decision.
+    """
+    n = 2 * num_rollouts
+    env = VecNTEnv(n, len(state.chip_hands), seed=rng)
+    env.hands[:] = state.hand_bits
+    env.chips[:] = state.chip_hands
+    env.card_pool[:] = state.card_pool
+    env.chip_pool[:] = state.chip_pool
+    env.current_player[:] = state.current_player
+    env.deck_index[:] = state.deck_index
+    env.decks[:] = state.deck
+    if not peek:
+        seen = np.bitwise_or.reduce(state.hand_bits) | (1 << state.card_pool)
+        unseen = ALL_CARDS[(seen >> ALL_CARDS) & 1 == 0]
+        deals = rng.permuted(np.broadcast_to(unseen, (num_rollouts, len(unseen))), axis=1)
+        env.decks[:, state.deck_index:] = np.tile(deals[:, :DECK_SIZE - state.deck_index], (2, 1))
+    return env
+
+
+def rollout_values(state, num_rollouts, rng, policy=ROLLOUT_POLICY, peek=False):
+    # Wins (ties count) and score margins (best other score minus the
+    # player's, positive when ahead) of the player to move in num_rollouts
+    # rollouts after taking, row 0, and after passing, row 1. policy plays
+    # every seat once the decision is made.
+    env = rollout_games(state, num_rollouts, rng, peek)
+    points = env.play_out(policy, np.arange(env.num_envs) < num_rollouts)
+    seat = state.current_player
+    others = np.delete(points, seat, axis=1).min(axis=1)
+    wins = points[:, seat] <= others
+    margins = others - points[:, seat]
+    return wins.reshape(2, num_rollouts), margins.reshape(2, num_rollouts)
+
+
+def rollout_play(player, game, num_rollouts=256, batch_size=256, time_budget=None,
+                 policy=ROLLOUT_POLICY, peek=False):
+    """
+    Monte Carlo lookahead as a play function (see tournament.get_strategy):
+    play the position out num_rollouts times after taking and after passing
+    and take when that wins at least as often, the mean margin breaking
+    ties. Rollouts are played batch_size at a time, all of a batch in one
+    VecNTEnv; with a time_budget in seconds no new batch is started once it
+    is spent, though one always is. They are seeded from game.rng, so
+    seeded games are reproducible as long as no time_budget cuts them short.
+    """
+    if player.chip_hand == 0:
+        return True
+    start = time.perf_counter()
+    rng = np.random.default_rng(game.rng.getrandbits(64))
+    state = game.clone()
+    wins, margins = np.zeros(2), np.zeros(2)
+    played = 0
+    while played < num_rollouts:
+        n = min(batch_size, num_rollouts - played)
+        batch_wins, batch_margins = rollout_values(state, n, rng, policy, peek)
+        wins += batch_wins.sum(axis=1)
+        margins += batch_margins.sum(axis=1)
+        played += n
+        if time_budget is not None and time.perf_counter() - start >= time_budget:
+            break
+    return (wins[0], margins[0]) >= (wins[1], margins[1])
@@ -3,14 +3,21 @@ import torch
 from torch.utils.tensorboard import SummaryWriter
 
 from dqn import DQN
+from trajectory import generate
 
 
 @click.command()
 @click.option("--env_id", type=str, default="MountainCar-v0", help="Environment Id")
 @click.option("--render", type=bool, default=False, help="Render environment or not")
 @click.option("--num_process", type=int, default=1, help="Number of process to run environment")
+@click.option("--num_envs", type=int, default=1, help="Number of games stepped together in one batched environment")
+@click.option("--num_players", type=str, default="3",
+              help="Player count, or comma separated counts (3 to 7) the environments are dealt in turn")
 @click.option("--lr", type=float, default=1e-3, help="Learning rate for Policy Net")
 @click.option("--gamma", type=float, default=0.99, help="Discount factor")
+@click.option("--n_step", type=int, default=1, help="Steps of reward summed into each target before bootstrapping")
+@click.option("--obs_mode", type=click.Choice(["float32", "packed"]), default="float32",
+              help="Observation format kept in replay memory, packed takes 12 bytes instead of 300")
 @click.option("--epsilon", type=float, default=0.90, help="Probability controls greedy action")
 @click.option("--explore_size", type=int, default=5000, help="Explore steps before execute deterministic policy")
 @click.option("--memory_size", type=int, default=100000, help="Size of replay memory")
@@ -20,33 +27,70 @@ from dqn import DQN
 @click.option("--update_target_gap", type=int, default=50, help="Steps between updating target q net")
 @click.option("--max_iter", type=int, default=500, help="Maximum iterations to run")
 @click.option("--eval_iter", type=int, default=50, help="Iterations to evaluate the model")
+@click.option("--eval_games", type=int, default=2000, help="Greedy games played against each opponent mix when evaluating")
+@click.option("--eval_opponents", type=str, multiple=True, default=("combine:0.5", "weighted"),
+              help="Opponent mix to evaluate against, one policy for every seat or one per seat, comma separated")
 @click.option("--save_iter", type=int, default=50, help="Iterations to save the model")
 @click.option("--model_path", type=str, default="trained_models", help="Directory to store model")
 @click.option("--log_path", type=str, default="../log/", help="Directory to save logs")
 @click.option("--seed", type=int, default=1, help="Seed for reproducing")
-def main(env_id, render, num_process, lr, gamma, epsilon, explore_size, memory_size, step_per_iter, batch_size,
-         min_update_step, update_target_gap, max_iter, eval_iter, save_iter, model_path, log_path, seed):
+@click.option("--prioritized", type=bool, default=False, help="Use prioritized experience replay or not")
+@click.option("--alpha", type=float, default=0.6, help="Priority exponent for prioritized replay")
+@click.option("--beta", type=float, default=0.4, help="Importance sampling exponent for prioritized replay")
+@click.option("--timing", type=bool, default=False, help="Log time spent in each phase of learning or not")
+@click.option("--async_mode", type=bool, default=False, help="Collect with num_process actors while learning asynchronously")
+@click.option("--update_ratio", type=float, default=1.0, help="Updates per collected transition in async mode")
+@click.option("--pretrain_data", type=str, default=None,
+              help="Trajectory dataset (see trajectory.py) to pretrain on before online learning")
+@click.option("--pretrain_games", type=int, default=0, help="Heuristic games to record into pretrain_data first")
+@click.option("--pretrain_seats", type=str, default="weighted,combine,combine",
+              help="Comma separated strategy per seat of the recorded games")
+@click.option("--pretrain_updates", type=int, default=10000, help="Updates on the dataset before online learning")
+@click.option("--pretrain_batch_size", type=int, default=1024, help="Batch size of pretraining updates")
+@click.option("--resume", type=bool, default=False, help="Resume from the checkpoint in model_path or not")
+def main(env_id, render, num_process, num_envs, num_players, lr, gamma, n_step, obs_mode, epsilon, explore_size, memory_size, step_per_iter, batch_size,
+         min_update_step, update_target_gap, max_iter, eval_iter, eval_games, eval_opponents, save_iter, model_path,
+         log_path, seed, prioritized, alpha, beta, timing, async_mode, update_ratio, pretrain_data, pretrain_games,
+         pretrain_seats, pretrain_updates, pretrain_batch_size, resume):
     base_dir = log_path + env_id + "/DQN_exp{}".format(seed)
     writer = SummaryWriter(base_dir)
     dqn = DQN(env_id,
               render=render,
               num_process=num_process,
+              num_envs=num_envs,
+              num_players=tuple(int(n) for n in num_players.split(',')),
               memory_size=memory_size,
               lr_q=lr,
               gamma=gamma,
+              n_step=n_step,
+              obs_mode=obs_mode,
               epsilon=epsilon,
               explore_size=explore_size,
               step_per_iter=step_per_iter,
               batch_size=batch_size,
               min_update_step=min_update_step,
               update_target_gap=update_target_gap,
-              seed=seed)
+              seed=seed,
+              prioritized=prioritized,
+              alpha=alpha,
+              beta=beta,
+              timing=timing,
+              async_mode=async_mode,
+              update_ratio=update_ratio,
+              eval_games=eval_games,
+              eval_opponents=eval_opponents)
 
-    for i_iter in range(1, max_iter + 1):
+    start_iter = dqn.load(model_path) + 1 if resume else 1
+    if pretrain_data and not resume:
+        if pretrain_games:
+            generate(pretrain_data, pretrain_seats.split(','), pretrain_games, seed=seed)
+        dqn.pretrain(pretrain_data, pretrain_updates, pretrain_batch_size, writer=writer)
+        dqn.eval(0, writer)
+    for i_iter in range(start_iter, max_iter + 1):
         dqn.learn(writer, i_iter)
 
         if i_iter % eval_iter == 0:
-            dqn.eval(i_iter, render=render)
+            dqn.eval(i_iter, writer)
 
         if i_iter % save_iter == 0:
             dqn.save(model_path)
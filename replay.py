@@ -0,0 +1,351 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from checkpoint import save_json, load_json
+from NTEnv import float_obs
+
+Batch = namedtuple('Batch', ('state', 'action', 'reward', 'next_state', 'mask', 'weight', 'index'),
+                   defaults=(None, None))
+
+
+# Columns written by ReplayBuffer.save, next states are rows of state
+COLUMNS = ('state', 'action', 'reward', 'mask', 'next_slot')
+PENDING = ('pending_slot', 'pending_stream', 'pending_open', 'pending_obs')
+
+
+class ReplayBuffer:
+    """
+    Replay memory backed by preallocated NumPy columns written as a ring.
+    push keeps the signature of total_util.Memory, and sample returns a Batch
+    of contiguous float32/int64 arrays that torch.from_numpy wraps without
+    copying. Columns are allocated on the first push, once the observation
+    size is known; packed uint8 observations (NTEnv obs_mode='packed') are
+    kept as uint8, anything else as float32. sample always returns float32
+    observations, packed ones are unpacked for the batch only.
+
+    Every observation is stored once. Transitions are pushed with the id of
+    the stream they come from (an env, a worker, a seat of a recorded game),
+    and the next_state of a transition is the state of the next transition
+    of its stream; next_slot points at its slot. The link is only made when
+    the two observations are equal, so a game abandoned halfway (e.g. by
+    NTEnv.reset) is never joined to the next one. Until the next transition
+    of the stream is pushed the next_state waits in a small pending table,
+    sorted by slot so that sample finds it by binary search; the latest
+    entry of each stream is open to be linked. Linking only to later slots
+    keeps the ring safe: a slot is always overwritten after every
+    transition pointing at it. Terminal transitions (mask 0) point at
+    themselves, as their next_state never enters a target.
+
+    With n_step > 1, sample follows next_slot up to n_step - 1 times to
+    return n-step transitions: reward is the discounted sum of the rewards
+    on the way, next_state the state reached, and mask is multiplied by
+    gamma^(k-1) for the k rewards summed, so the one-step target
+    reward + gamma * mask * max Q(next_state) becomes the n-step one. A
+    chain never leaves its stream and stops early at the end of a game or
+    at a next_state that has not been pushed as a state yet.
+    """
+    def __init__(self, size=1000000, n_step=1, gamma=0.99):
+        self.size = size
+        self.n_step = n_step
+        self.gamma = gamma
+        self.index = 0
+        self.full = False
+        self.num_pushed = 0
+        self.state = None
+
+    def _allocate(self, state):
+        dtype = np.uint8 if state.dtype == np.uint8 else np.float32
+        self.state = np.empty((self.size, len(state)), dtype=dtype)
+        self.action = np.empty(self.size, dtype=np.int64)
+        self.reward = np.empty(self.size, dtype=np.float32)
+        self.mask = np.empty(self.size, dtype=np.float32)
+        self.next_slot = np.empty(self.size, dtype=np.int64)
+        self.pending_slot = np.empty(0, dtype=np.int64)
+        self.pending_stream = np.empty(0, dtype=np.int64)
+        self.pending_open = np.empty(0, dtype=bool)
+        self.pending_obs = np.empty((0, len(state)), dtype=dtype)
+
+    def push(self, state, action, reward, next_state, mask, log_prob=None, stream=0):
+        if self.state is None:
+            self._allocate(np.asarray(state))
+        i = self.index
+        last = (i - 1) % self.size
+        pos = np.searchsorted(self.pending_slot, [last, i])
+        if pos[0] == len(self.pending_slot) or self.pending_slot[pos[0]] != last \
+                or not self.pending_open[pos[0]] or self.pending_stream[pos[0]] != stream \
+                or not np.array_equal(self.pending_obs[pos[0]], state) \
+                or (pos[1] < len(self.pending_slot) and self.pending_slot[pos[1]] == i):
+            self.push_batch(np.asarray(state)[None], [action], [reward], np.asarray(next_state)[None], [mask],
+                            [stream])
+            return
+        # Usual case of one game pushed step by step: state is the next_state
+        # of the last transition of the stream, which is still pending
+        self.next_slot[last] = i
+        self.state[i] = state
+        self.action[i] = action
+        self.reward[i] = reward
+        self.mask[i] = mask
+        self.next_slot[i] = i
+        if mask and i > 0:
+            # The new entry takes the place of the linked one, no slot lies
+            # between them so the table stays sorted
+            self.next_slot[i] = -1
+            self.pending_slot[pos[0]] = i
+            self.pending_obs[pos[0]] = next_state
+        else:
+            self._keep_pending(np.arange(len(self.pending_slot)) != pos[0])
+            if mask:
+                self.next_slot[i] = -1
+                self._add_pending(np.array([i]), np.array([stream]), np.array([True]),
+                                  np.asarray(next_state, dtype=self.state.dtype)[None])
+        self.index = (i + 1) % self.size
+        self.full = self.full or self.index == 0
+        self.num_pushed += 1
+
+    def push_batch(self, states, actions, rewards, next_states, masks, streams=None):
+        # Write a chunk of transitions at once, wrapping around the ring. Rows
+        # of the same stream are in the order they were played; without
+        # streams the whole chunk is one stream.
+        if self.state is None:
+            self._allocate(np.asarray(states[0]))
+        dtype = self.state.dtype
+        states, next_states = np.asarray(states, dtype=dtype), np.asarray(next_states, dtype=dtype)
+        actions, rewards, masks = np.asarray(actions), np.asarray(rewards), np.asarray(masks)
+        streams = np.zeros(len(actions), dtype=np.int64) if streams is None else np.asarray(streams)
+        if len(actions) > self.size:
+            # Only the last size transitions would survive
+            skip = len(actions) - self.size
+            self.num_pushed += skip
+            self.index = (self.index + skip) % self.size
+            states, actions, rewards, next_states, masks, streams = (
+                states[skip:], actions[skip:], rewards[skip:], next_states[skip:], masks[skip:], streams[skip:])
+        n = len(actions)
+        idx = (self.index + np.arange(n)) % self.size
+
+        # Slots about to be overwritten no longer wait for anything
+        self._keep_pending((self.pending_slot - self.index) % self.size >= n)
+
+        self.state[idx] = states
+        self.action[idx] = actions
+        self.reward[idx] = rewards
+        self.mask[idx] = masks
+        self.next_slot[idx] = idx
+        self._link(states, next_states, masks != 0, streams, idx)
+
+        self.full = self.full or self.index + n >= self.size
+        self.index = (self.index + n) % self.size
+        self.num_pushed += n
+
+    def _link(self, states, next_states, live, streams, idx):
+        if len(streams) == 0:
+            return
+        # Rows grouped by stream, each group in push order
+        order = np.lexsort((np.arange(len(streams)), streams))
+        sorted_streams = streams[order]
+        first = np.r_[True, sorted_streams[1:] != sorted_streams[:-1]]
+        last = np.r_[first[1:], True]
+
+        # The open entry of a stream waits for the stream's first new row
+        waiting = np.flatnonzero(self.pending_open)
+        heads = order[first]
+        pos = np.minimum(np.searchsorted(sorted_streams[first], self.pending_stream[waiting]), len(heads) - 1)
+        arrived = sorted_streams[first][pos] == self.pending_stream[waiting]
+        waiting, head = waiting[arrived], heads[pos[arrived]]
+        match = (states[head] == self.pending_obs[waiting]).all(axis=1)
+        self.next_slot[self.pending_slot[waiting[match]]] = idx[head[match]]
+        self.pending_open[waiting] = False
+        self._keep_pending(~np.isin(np.arange(len(self.pending_slot)), waiting[match]))
+
+        # Every other row is followed by the next row of its stream
+        row, following = order[:-1][~first[1:]], order[1:][~first[1:]]
+        match = live[row] & (next_states[row] == states[following]).all(axis=1)
+        self.next_slot[idx[row[match]]] = idx[following[match]]
+
+        # Live rows left without a successor wait for it, only the last
+        # row of each stream can still get one
+        unlinked = live.copy()
+        unlinked[row[match]] = False
+        open_rows = np.zeros(len(streams), dtype=bool)
+        open_rows[order[last]] = True
+        self.next_slot[idx[unlinked]] = -1
+        self._add_pending(idx[unlinked], streams[unlinked], open_rows[unlinked], next_states[unlinked])
+
+    def _add_pending(self, slots, *columns):
+        # Insert entries into the pending table, which is kept sorted by slot
+        order = np.argsort(slots)
+        pos = np.searchsorted(self.pending_slot, slots[order])
+        for name, column in zip(PENDING, (slots,) + columns):
+            setattr(self, name, np.insert(getattr(self, name), pos, column[order], axis=0))
+
+    def _keep_pending(self, keep):
+        for name in PENDING:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def _next_states(self, idx):
+        next_slot = self.next_slot[idx]
+        next_states = self.state[next_slot]
+        waiting = next_slot < 0
+        if waiting.any():
+            next_states[waiting] = self.pending_obs[np.searchsorted(self.pending_slot, idx[waiting])]
+        return float_obs(next_states)
+
+    def _targets(self, idx):
+        # (reward, next_state, mask) of the n-step transitions starting at idx
+        if self.n_step == 1:
+            return self.reward[idx], self._next_states(idx), self.mask[idx]
+        reward = self.reward[idx].copy()
+        mask = self.mask[idx].copy()
+        slot = idx.copy()
+        discount = np.ones(len(idx), dtype=np.float32)
+        for k in range(1, self.n_step):
+            step = (mask != 0) & (self.next_slot[slot] >= 0)
+            if not step.any():
+                break
+            slot[step] = self.next_slot[slot[step]]
+            discount[step] *= self.gamma
+            reward[step] += discount[step] * self.reward[slot[step]]
+            mask[step] = self.mask[slot[step]]
+        return reward, self._next_states(slot), mask * discount
+
+    def sample(self, batch_size=None):
+        if batch_size is None:
+            idx = np.arange(len(self))
+        else:
+            idx = np.random.randint(0, len(self), batch_size)
+        reward, next_state, mask = self._targets(idx)
+        return Batch(float_obs(self.state[idx]), self.action[idx], reward, next_state, mask)
+
+    def __len__(self):
+        return self.size if self.full else self.index
+
+    def save(self, path):
+        # One .npy file per column and pending array plus meta.json
+        os.makedirs(path, exist_ok=True)
+        save_json(os.path.join(path, 'meta.json'), self._meta())
+        if self.state is not None:
+            for name in COLUMNS + PENDING:
+                np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    def load(self, path):
+        # Map the saved columns copy-on-write: pages are read as they are
+        # sampled and new pushes never touch the files
+        meta = load_json(os.path.join(path, 'meta.json'))
+        if meta['size'] != self.size:
+            raise ValueError(f"Saved replay memory has size {meta['size']}, expected {self.size}")
+        self._load_meta(meta)
+        if os.path.exists(os.path.join(path, 'state.npy')):
+            for name in COLUMNS:
+                setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='c'))
+            for name in PENDING:
+                setattr(self, name, np.load(os.path.join(path, name + '.npy')))
+
+    def _meta(self):
+        return {'size': self.size, 'index': self.index, 'full': self.full, 'num_pushed': self.num_pushed}
+
+    def _load_meta(self, meta):
+        self.index = meta['index']
+        self.full = meta['full']
+        self.num_pushed = meta['num_pushed']
+
+
+class SumTree:
+    """
+    Binary tree over capacity leaf priorities where every node holds the sum
+    of its children, stored heap style (root at 1, leaves from self.leaf).
+    Updating a batch of leaves and finding the leaves for a batch of prefix
+    sums both take O(log n) NumPy steps.
+    """
+    def __init__(self, capacity):
+        self.leaf = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.leaf)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[self.leaf + idx]
+
+    def update(self, idx, priority):
+        nodes = self.leaf + np.asarray(idx)
+        self.tree[nodes] = priority
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        # Leaf index whose cumulative priority range contains each value
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        while nodes[0] < self.leaf:
+            left = self.tree[2 * nodes]
+            right = values >= left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.leaf
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer sampling transition i with probability p_i^alpha / sum p^alpha.
+    New transitions get the current maximum priority so each is seen at
+    least once; update_priorities sets p_i = |td error| + eps after learning.
+    sample fills Batch.weight with importance sampling weights
+    (N * P(i))^-beta normalised by their maximum, and Batch.index with the
+    sampled slots.
+    """
+    def __init__(self, size=1000000, alpha=0.6, beta=0.4, eps=1e-6, n_step=1, gamma=0.99):
+        super().__init__(size, n_step, gamma)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.tree = SumTree(size)
+        self.max_priority = 1.0
+
+    def push(self, state, action, reward, next_state, mask, log_prob=None, stream=0):
+        index = self.index
+        super().push(state, action, reward, next_state, mask, log_prob, stream)
+        self.tree.update([index], self.max_priority)
+
+    def push_batch(self, states, actions, rewards, next_states, masks, streams=None):
+        idx = (self.index + np.arange(len(actions))) % self.size
+        super().push_batch(states, actions, rewards, next_states, masks, streams)
+        self.tree.update(idx, self.max_priority)
+
+    def sample(self, batch_size=None):
+        if batch_size is None:
+            return super().sample()
+        # One draw from each of batch_size equal slices of the total
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * total / batch_size
+        idx = np.minimum(self.tree.find(values), len(self) - 1)
+
+        probs = self.tree.get(idx) / total
+        weight = (len(self) * probs) ** -self.beta
+        weight = (weight / weight.max()).astype(np.float32)
+        reward, next_state, mask = self._targets(idx)
+        return Batch(float_obs(self.state[idx]), self.action[idx], reward, next_state, mask, weight, idx)
+
+    def save(self, path):
+        super().save(path)
+        np.save(os.path.join(path, 'tree.npy'), self.tree.tree)
+
+    def load(self, path):
+        super().load(path)
+        self.tree.tree = np.load(os.path.join(path, 'tree.npy'))
+
+    def _meta(self):
+        meta = super()._meta()
+        meta['max_priority'] = float(self.max_priority)
+        return meta
+
+    def _load_meta(self, meta):
+        super()._load_meta(meta)
+        self.max_priority = meta['max_priority']
+
+    def update_priorities(self, idx, td_errors):
+        priority = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(idx, priority)
+        self.max_priority = max(self.max_priority, priority.max())
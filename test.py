@@ -1,43 +1,26 @@
+import time
+
 import click
 
-from Algorithms.pytorch.DQN.dqn import DQN
+from inference import evaluate, export_torchscript
 
 
 @click.command()
 @click.option("--env_id", type=str, default="MountainCar-v0", help="Environment Id")
-@click.option("--render", type=bool, default=False, help="Render environment or not")
-@click.option("--num_process", type=int, default=1, help="Number of process to run environment")
-@click.option("--lr", type=float, default=1e-3, help="Learning rate for Policy Net")
-@click.option("--gamma", type=float, default=0.99, help="Discount factor")
-@click.option("--epsilon", type=float, default=0.90, help="Probability controls greedy action")
-@click.option("--explore_size", type=int, default=10000, help="Explore steps before execute deterministic policy")
-@click.option("--memory_size", type=int, default=1000000, help="Size of replay memory")
-@click.option("--step_per_iter", type=int, default=3500, help="Number of steps of interaction in each iteration")
-@click.option("--batch_size", type=int, default=100, help="Batch size")
-@click.option("--min_update_step", type=int, default=1000, help="Minimum interacts for updating")
-@click.option("--update_target_gap", type=int, default=50, help="Steps between updating target q net")
-@click.option("--model_path", type=str, default="trained_models", help="Directory to store model")
+@click.option("--model_path", type=str, default="trained_models", help="Directory the model was saved to")
+@click.option("--num_process", type=int, default=1, help="Number of process to play test games")
 @click.option("--seed", type=int, default=1, help="Seed for reproducing")
-@click.option("--test_epochs", type=int, default=50, help="Trials to test trained model")
-def main(env_id, render, num_process, lr, gamma, epsilon, explore_size, memory_size, step_per_iter, batch_size,
-         min_update_step, update_target_gap, model_path, seed, test_epochs):
-    dqn = DQN(env_id,
-              render=render,
-              num_process=num_process,
-              memory_size=memory_size,
-              lr_q=lr,
-              gamma=gamma,
-              epsilon=epsilon,
-              explore_size=explore_size,
-              step_per_iter=step_per_iter,
-              batch_size=batch_size,
-              min_update_step=min_update_step,
-              update_target_gap=update_target_gap,
-              seed=seed,
-              model_path=model_path)
-
-    for i_iter in range(1, test_epochs + 1):
-        dqn.eval(i_iter)
+@click.option("--test_epochs", type=int, default=50, help="Games to test trained model")
+@click.option("--export", is_flag=True, help="Export a TorchScript CPU model next to the weights first")
+def main(env_id, model_path, num_process, seed, test_epochs, export):
+    start = time.perf_counter()
+    path = '{}/{}_dqn'.format(model_path, env_id)
+    if export:
+        export_torchscript(path)
+    result = evaluate(path, test_epochs, num_process, seed)
+    low, high = result['win_rate_ci']
+    print(f"games: {result['num_games']}, win rate: {result['win_rate']:.3f} "
+          f"(95% CI {low:.3f}-{high:.3f}), time: {time.perf_counter() - start:.2f}s")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,51 @@
+import time
+from collections import defaultdict
+
+
+class PhaseTimer:
+    """
+    Wall-clock time spent in each phase of a DQN.learn iteration:
+
+        tic = timer.start()
+        ...
+        timer.stop('env_step', tic)
+
+    write exports the totals of the iteration as "time/<phase>" scalars,
+    together with steps and updates per second, and starts the next one.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.totals = defaultdict(float)
+        self.iter_start = time.perf_counter()
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, phase, start):
+        self.totals[phase] += time.perf_counter() - start
+
+    def write(self, writer, i_iter, num_steps, num_updates):
+        elapsed = time.perf_counter() - self.iter_start
+        for phase, total in self.totals.items():
+            writer.add_scalar("time/" + phase, total, i_iter)
+        writer.add_scalar("time/iteration", elapsed, i_iter)
+        writer.add_scalar("steps per sec", num_steps / elapsed, i_iter)
+        writer.add_scalar("updates per sec", num_updates / elapsed, i_iter)
+        self.reset()
+
+
+class NullTimer:
+    # PhaseTimer interface that records nothing, used when timing is off
+    def reset(self):
+        pass
+
+    def start(self):
+        return 0
+
+    def stop(self, phase, start):
+        pass
+
+    def write(self, writer, i_iter, num_steps, num_updates):
+        pass
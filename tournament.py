@@ -0,0 +1,145 @@
+import functools
+import math
+import sys
+import time
+from multiprocessing import Pool
+
+import click
+import numpy as np
+
+import No_Thanks
+from NTEnv import Game, Player, seed_stream, seeded_rngs
+from lookahead import rollout_play
+
+# Chip weightings that "weighted:<name>" seats can use
+CHIP_WEIGHTS = {
+    'quadratic': Player.chip_weight,
+    'linear': No_Thanks.Player.chip_weight,
+}
+
+# play(player, game) -> True to take the card
+STRATEGIES = {
+    'weighted': Player.weighted_play,
+    'random': Player.rand_play,
+    'combine': Player.combine_play,
+    # The heuristic Run_Game in No_Thanks.py plays
+    'no_thanks': No_Thanks.Player.weighted_play,
+    # Monte Carlo lookahead, see lookahead.rollout_play
+    'rollout': rollout_play,
+}
+
+
+def get_strategy(spec):
+    """
+    Turn a seat spec into a play function. A spec is a STRATEGIES name,
+    optionally followed by ':' and an argument: the combine probability for
+    'combine' (e.g. combine:0.8), a CHIP_WEIGHTS name for 'weighted'
+    (e.g. weighted:linear) or the budget per move for 'rollout', a number
+    of rollouts (e.g. rollout:512) or seconds (e.g. rollout:0.05s).
+    Callables are returned as they are.
+    """
+    if callable(spec):
+        return spec
+    name, _, arg = spec.partition(':')
+    play = STRATEGIES[name]
+    if arg and name == 'combine':
+        return functools.partial(play, prob=float(arg))
+    if arg and name == 'weighted':
+        return functools.partial(play, chip_weight=CHIP_WEIGHTS[arg])
+    if arg and name == 'rollout' and arg.endswith('s'):
+        return functools.partial(play, num_rollouts=sys.maxsize, time_budget=float(arg[:-1]))
+    if arg and name == 'rollout':
+        return functools.partial(play, num_rollouts=int(arg))
+    if arg:
+        raise ValueError(f"Strategy {name} takes no argument: {spec}")
+    return play
+
+
+def play_games(seats, num_games, seed, recorder=None):
+    # Play num_games seeded games, returns the final scores, one row per game.
+    # recorder is passed on to every Game
+    plays = [get_strategy(spec) for spec in seats]
+    rng, decks = seeded_rngs(seed)
+    scores = np.empty((num_games, len(seats)), dtype=np.int16)
+    for g in range(num_games):
+        players = [Player("seat" + str(i)) for i in range(len(seats))]
+        game = Game(players, rng, decks=decks, recorder=recorder)
+        while not game.done:
+            seat = game.current_player
+            game.step(plays[seat](players[seat], game))
+        scores[g] = game.points()
+    return scores
+
+
+def wilson_interval(wins, n, z=1.96):
+    # 95% Wilson score interval for a win rate of wins / n
+    if n == 0:
+        return 0.0, 1.0
+    p = wins / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return centre - half, centre + half
+
+
+def summarize(seats, scores):
+    # Per seat win rate (every seat on the lowest score wins) and scores
+    wins = scores == scores.min(axis=1, keepdims=True)
+    n = len(scores)
+    results = []
+    for i, spec in enumerate(seats):
+        k = int(wins[:, i].sum())
+        seat_scores = scores[:, i]
+        results.append({
+            'seat': i,
+            'strategy': spec if isinstance(spec, str) else getattr(spec, '__name__', repr(spec)),
+            'win_rate': k / n,
+            'win_rate_ci': wilson_interval(k, n),
+            'mean_score': float(seat_scores.mean()),
+            'std_score': float(seat_scores.std()),
+            'score_percentiles': dict(zip((5, 25, 50, 75, 95),
+                                          np.percentile(seat_scores, (5, 25, 50, 75, 95)).tolist())),
+        })
+    return results
+
+
+def run_tournament(seats, num_games=100000, num_process=None, seed=1, chunk_size=10000):
+    """
+    Play num_games games with one player per entry of seats (see
+    get_strategy), split into seeded chunks of chunk_size games across a
+    pool of num_process workers (all cores by default). Results only depend
+    on seed and chunk_size, not on the number of workers.
+    """
+    chunks = [(seats, min(chunk_size, num_games - start), seed_stream(seed, c))
+              for c, start in enumerate(range(0, num_games, chunk_size))]
+    if num_process == 1:
+        scores = [play_games(*chunk) for chunk in chunks]
+    else:
+        with Pool(num_process) as pool:
+            scores = pool.starmap(play_games, chunks)
+    scores = np.concatenate(scores)
+    return {'num_games': len(scores), 'seats': summarize(seats, scores), 'scores': scores}
+
+
+@click.command()
+@click.option("--seats", type=str, default="weighted,random,combine",
+              help="Comma separated strategy per seat, e.g. weighted,weighted:linear,combine:0.8,rollout:256")
+@click.option("--num_games", type=int, default=100000, help="Number of games to play")
+@click.option("--num_process", type=int, default=None, help="Number of worker processes, all cores by default")
+@click.option("--chunk_size", type=int, default=10000, help="Games per seeded chunk of work")
+@click.option("--seed", type=int, default=1, help="Seed for reproducing")
+def main(seats, num_games, num_process, chunk_size, seed):
+    seats = seats.split(',')
+    start = time.time()
+    result = run_tournament(seats, num_games, num_process, seed, chunk_size)
+    elapsed = time.time() - start
+
+    print(f"{result['num_games']} games in {elapsed:.1f}s ({result['num_games'] / elapsed:.0f} games/s)")
+    for seat in result['seats']:
+        low, high = seat['win_rate_ci']
+        print(f"seat {seat['seat']} {seat['strategy']:<18} win rate {seat['win_rate']:.4f} "
+              f"[{low:.4f}, {high:.4f}]  score {seat['mean_score']:.2f} +- {seat['std_score']:.2f}  "
+              f"median {seat['score_percentiles'][50]:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import glob
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import click
+import numpy as np
+
+from NTEnv import NUM_CARDS, OBS_SIZE, hand_bits, seed_stream, DATASET_STREAM
+from tournament import play_games
+
+# One row per decision: the state the decider saw and what it did. Each row
+# is self-contained, so any slice of a shard can be read on its own.
+DECISION_COLUMNS = {
+    'hands': np.int64,        # (rows, num_players) bitmask hands
+    'chips': np.uint8,        # (rows, num_players)
+    'card': np.uint8,         # card_pool
+    'chip_pool': np.uint8,
+    'seat': np.uint8,         # deciding player
+    'action': np.uint8,       # 0 took the card, 1 passed, as in NTEnv.step
+}
+# One row per game; offsets has one more entry, game g is decision rows
+# offsets[g]:offsets[g + 1] of its shard
+GAME_COLUMNS = {
+    'offsets': np.int64,
+    'first_player': np.uint8,
+    'start_chips': np.uint8,  # (games, num_players)
+    'deck': np.uint8,         # (games, 24) in drawing order
+    'scores': np.int16,       # (games, num_players) final points
+}
+
+
+class TrajectoryWriter:
+    """
+    Game recorder (pass it as Game(recorder=...) or NTEnv(recorder=...))
+    writing in bulk a shard once shard_size decisions are done: a directory
+    <prefix>_<n> holding one .npy file per column of DECISION_COLUMNS and
+    GAME_COLUMNS and meta.json, which is written last. meta is stored in
+    every meta.json. Only card, chip_pool, seat and action are kept per
+    decision while playing; the hands and chips columns are rebuilt from
+    them when the shard is written.
+    """
+    def __init__(self, path, num_players=3, shard_size=1000000, prefix='shard', meta=None):
+        self.path = path
+        self.num_players = num_players
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.meta = meta or {}
+        self.num_shards = 0
+        os.makedirs(path, exist_ok=True)
+        self._clear()
+
+    def _clear(self):
+        self.decisions = []
+        self.games = {name: [] for name in GAME_COLUMNS}
+        self.games['offsets'].append(0)
+
+    def start_game(self, game):
+        # A game still open was abandoned (e.g. by NTEnv.reset), drop it
+        num_games = len(self.games['scores'])
+        del self.decisions[self.games['offsets'][-1]:]
+        for name in ('first_player', 'start_chips', 'deck'):
+            del self.games[name][num_games:]
+        self.games['first_player'].append(game.current_player)
+        self.games['start_chips'].append([player.chip_hand for player in game.players])
+        self.games['deck'].append(game.deck.deck)
+
+    def record(self, game, take):
+        self.decisions.append((game.card_pool, game.chip_pool, game.current_player, take))
+
+    def end_game(self, game):
+        self.games['offsets'].append(len(self.decisions))
+        self.games['scores'].append(game.points())
+        if len(self.decisions) >= self.shard_size:
+            self.flush()
+
+    def _columns(self, num_games, num_rows):
+        # Decision columns of the finished games. The hands and chips before
+        # each decision are the start of the game plus everything taken and
+        # paid by earlier decisions of the same game: a running sum over the
+        # shard minus its value at the first decision of the game. Cards are
+        # taken once per game, so summing hand bits is ORing them.
+        card, chip_pool, seat, take = np.array(self.decisions[:num_rows], dtype=np.int64).reshape(-1, 4).T
+        offsets = np.array(self.games['offsets'][:num_games + 1])
+        game = np.repeat(np.arange(num_games), np.diff(offsets))
+        rows = np.arange(num_rows)
+
+        def before(delta):
+            total = np.cumsum(delta, axis=0) - delta
+            return total - total[offsets[game]]
+
+        hand_delta = np.zeros((num_rows, self.num_players), dtype=np.int64)
+        hand_delta[rows, seat] = np.where(take == 1, np.int64(1) << card, 0)
+        chip_delta = np.zeros((num_rows, self.num_players), dtype=np.int64)
+        chip_delta[rows, seat] = np.where(take == 1, chip_pool, -1)
+        start_chips = np.array(self.games['start_chips'][:num_games], dtype=np.int64)
+        return {'hands': before(hand_delta), 'chips': start_chips[game] + before(chip_delta),
+                'card': card, 'chip_pool': chip_pool, 'seat': seat, 'action': 1 - take}
+
+    def flush(self):
+        # Write the finished games as the next shard; decisions of a game
+        # still being played are dropped
+        num_games = len(self.games['scores'])
+        if num_games == 0:
+            return
+        num_rows = self.games['offsets'][-1]
+        shard = os.path.join(self.path, f"{self.prefix}_{self.num_shards:05d}")
+        os.makedirs(shard, exist_ok=True)
+        for name, column in self._columns(num_games, num_rows).items():
+            np.save(os.path.join(shard, name + '.npy'), column.astype(DECISION_COLUMNS[name]))
+        for name, dtype in GAME_COLUMNS.items():
+            np.save(os.path.join(shard, name + '.npy'), np.array(self.games[name][:num_games + (name == 'offsets')],
+                                                                   dtype=dtype))
+        with open(os.path.join(shard, 'meta.json'), 'w') as f:
+            json.dump({'num_players': self.num_players, 'num_games': num_games, 'num_rows': num_rows,
+                       **self.meta}, f, indent=2)
+        self.num_shards += 1
+        self._clear()
+
+    def close(self):
+        self.flush()
+
+
+class TrajectoryReader:
+    """
+    Every shard under path, memory-mapped read-only: columns are read from
+    disk as they are sliced, so datasets larger than RAM can be streamed.
+    """
+    def __init__(self, path):
+        self.shards = []
+        for meta_path in sorted(glob.glob(os.path.join(path, '*', 'meta.json'))):
+            shard = os.path.dirname(meta_path)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            columns = {name: np.load(os.path.join(shard, name + '.npy'), mmap_mode='r')
+                       for name in list(DECISION_COLUMNS) + list(GAME_COLUMNS)}
+            self.shards.append((meta, columns))
+
+    def __len__(self):
+        return sum(meta['num_rows'] for meta, _ in self.shards)
+
+    @property
+    def num_games(self):
+        return sum(meta['num_games'] for meta, _ in self.shards)
+
+    def iter_shards(self):
+        # (meta, columns) of every shard, columns still memory-mapped
+        return iter(self.shards)
+
+    def iter_batches(self, batch_size=65536, columns=tuple(DECISION_COLUMNS)):
+        # Decision rows in order as dicts of in-memory arrays; batches don't
+        # span shards, so the last one of each shard may be shorter
+        for meta, shard in self.shards:
+            for start in range(0, meta['num_rows'], batch_size):
+                yield {name: np.array(shard[name][start:start + batch_size]) for name in columns}
+
+    def game_column(self, name):
+        # A GAME_COLUMNS column of every shard concatenated (offsets excluded)
+        return np.concatenate([shard[name] for _, shard in self.shards])
+
+
+def observations(batch):
+    # NTEnv float32 observations of the deciding player for a batch of
+    # decision rows
+    rows = np.arange(len(batch['seat']))
+    seat = batch['seat'].astype(np.int64)
+    own = batch['hands'][rows, seat]
+    obs = np.empty((len(rows), OBS_SIZE), dtype=np.float32)
+    obs[:, :NUM_CARDS] = hand_bits(own)
+    obs[:, NUM_CARDS] = batch['chips'][rows, seat]
+    obs[:, NUM_CARDS + 1:-2] = hand_bits(np.bitwise_or.reduce(batch['hands'], axis=1) ^ own)
+    obs[:, -2] = batch['card']
+    obs[:, -1] = batch['chip_pool']
+    return obs
+
+
+def iter_transitions(reader, seats=None, games_per_batch=5000):
+    """
+    Replay memory transitions (states, actions, rewards, next_states, masks,
+    streams) of the decisions of seats (all by default), each from the
+    deciding player's point of view as if it were the NTEnv agent:
+    next_state is its own next decision in the game and the last one gets
+    +-100 and mask 0. next_state of a last decision is its own state, masked
+    out anyway. Every seat of every game is its own stream, numbered across
+    the whole dataset. Yields one batch per games_per_batch games of every
+    shard.
+    """
+    num_games = 0
+    for meta, shard in reader.iter_shards():
+        offsets = shard['offsets']
+        for g0 in range(0, meta['num_games'], games_per_batch):
+            g1 = min(g0 + games_per_batch, meta['num_games'])
+            lo, hi = offsets[g0], offsets[g1]
+            batch = {name: np.array(shard[name][lo:hi]) for name in DECISION_COLUMNS}
+            game = np.repeat(np.arange(g1 - g0), np.diff(offsets[g0:g1 + 1]))
+            seat = batch['seat'].astype(np.int64)
+
+            # Rows ordered by game, seat and position: consecutive entries of
+            # the same game and seat are a decision and the next one
+            order = np.lexsort((np.arange(hi - lo), seat, game))
+            same = (game[order[1:]] == game[order[:-1]]) & (seat[order[1:]] == seat[order[:-1]])
+            next_row = np.arange(hi - lo)
+            next_row[order[:-1][same]] = order[1:][same]
+            last = next_row == np.arange(hi - lo)
+
+            scores = np.array(shard['scores'][g0:g1])
+            won = scores[game, seat] == scores[game].min(axis=1)
+            states = observations(batch)
+            keep = slice(None) if seats is None else np.isin(seat, seats)
+            streams = (num_games + game) * meta['num_players'] + seat
+            num_games += g1 - g0
+            yield (states[keep], batch['action'][keep].astype(np.int64),
+                   np.where(last, np.where(won, 100., -100.), 0.)[keep],
+                   states[next_row][keep], (~last)[keep].astype(np.float32), streams[keep])
+
+
+def record_games(path, seats, num_games, seed, prefix):
+    # tournament.play_games with every game recorded into shards <prefix>_<n>
+    writer = TrajectoryWriter(path, len(seats), prefix=prefix, meta={'seats': list(seats)})
+    play_games(seats, num_games, seed, recorder=writer)
+    writer.close()
+
+
+def generate(path, seats, num_games, num_process=None, seed=1, chunk_size=10000):
+    """
+    Record num_games games of seats (see tournament.get_strategy) under
+    path, split into seeded chunks of chunk_size games across num_process
+    workers, each chunk writing its own shards. The dataset only depends
+    on seed and chunk_size, as in tournament.run_tournament.
+    """
+    chunks = [(path, seats, min(chunk_size, num_games - start), seed_stream(seed, DATASET_STREAM, c), f"chunk{c:05d}")
+              for c, start in enumerate(range(0, num_games, chunk_size))]
+    if num_process == 1:
+        for chunk in chunks:
+            record_games(*chunk)
+    else:
+        with Pool(num_process) as pool:
+            pool.starmap(record_games, chunks)
+
+
+@click.command()
+@click.option("--output", type=str, default="trajectories", help="Directory to write the shards to")
+@click.option("--seats", type=str, default="weighted,combine,combine",
+              help="Comma separated strategy per seat, e.g. weighted,weighted:linear,combine:0.8,rollout:256")
+@click.option("--num_games", type=int, default=100000, help="Number of games to record")
+@click.option("--num_process", type=int, default=None, help="Number of worker processes, all cores by default")
+@click.option("--chunk_size", type=int, default=10000, help="Games per seeded chunk of work")
+@click.option("--seed", type=int, default=1, help="Seed for reproducing")
+def main(output, seats, num_games, num_process, chunk_size, seed):
+    start = time.time()
+    generate(output, seats.split(','), num_games, num_process, seed, chunk_size)
+    elapsed = time.time() - start
+    reader = TrajectoryReader(output)
+    size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(output, '*', '*.npy')))
+    print(f"{reader.num_games} games, {len(reader)} decisions in {elapsed:.1f}s "
+          f"({reader.num_games / elapsed:.0f} games/s), {size / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()